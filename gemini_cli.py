@@ -5,11 +5,16 @@ Interactive Chat dengan Agentic Capabilities.
 """
 import os
 import sys
+import base64
 import logging
+import mimetypes
 from gemini_core.client import GeminiClient
-from gemini_core.chat import ChatSession
-from gemini_core.chat import ChatSession
+from gemini_core.chat import ChatSession, RESPONSE_CACHE_MAX_TEMPERATURE
 from gemini_core.config import DEFAULT_CREDENTIALS_FILE
+from gemini_core.mcp import MCPClient
+from gemini_core.personas import get_persona
+from gemini_core.tools import registry
+import gemini_core.config as config
 try:
     import questionary
     from rich.console import Console
@@ -41,51 +46,228 @@ import threading
 import time
 import sys
 
+# Spinner service: satu thread long-lived untuk semua Spinner (bukan 1 thread per prompt)
+_SPINNER_SVC = None
+_SPINNER_LOCK = threading.Lock()   # Serialize frame writes vs stop()
+_SPINNER_WAKE = threading.Event()  # Poked by start()/stop()
+_SPINNER_ACTIVE = None             # Spinner yang sedang tampil (atau None)
+_SPINNER_INTERVAL = 0.1
+
+def _spinner_loop():
+    wake_wait = _SPINNER_WAKE.wait
+    wake_clear = _SPINNER_WAKE.clear
+    monotonic = time.monotonic
+    lock = _SPINNER_LOCK
+    while True:
+        wake_wait()
+        wake_clear()
+        # Bind sekali per aktivasi (bukan per tick); sys.stdout bisa diganti Live() saat menu
+        write = sys.stdout.buffer.write
+        flush = sys.stdout.flush
+        deadline = monotonic()
+        while True:
+            with lock:
+                spinner = _SPINNER_ACTIVE
+                if spinner is None:
+                    break
+                i = spinner.frame
+                write(spinner._frames[i])
+                flush()
+                spinner.frame = (i + 1) % len(_SPINNER_CHARS)
+            deadline += _SPINNER_INTERVAL
+            # Bangun lebih cepat kalau ada start()/stop() baru
+            if wake_wait(max(0.0, deadline - monotonic())):
+                wake_clear()
+                deadline = monotonic()
+
+def _start_spinner_service():
+    global _SPINNER_SVC
+    if _SPINNER_SVC is None:
+        _SPINNER_SVC = threading.Thread(target=_spinner_loop, daemon=True)
+        _SPINNER_SVC.start()
+
+_SPINNER_CHARS = "⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"
+
 class Spinner:
     def __init__(self, message="Thinking..."):
         self.message = message
         self.spinning = False
-        self.thread = None
-
-    def spin(self):
-        chars = "⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"
-        i = 0
-        while self.spinning:
-            sys.stdout.write(f"\r{self.message} {chars[i % len(chars)]}")
-            sys.stdout.flush()
-            time.sleep(0.1)
-            i += 1
-        sys.stdout.write("\r" + " " * (len(self.message) + 5) + "\r")
-        sys.stdout.flush()
+        self.frame = 0
+
+    @property
+    def message(self):
+        return self._message
+
+    @message.setter
+    def message(self, value):
+        # Precompute semua frame sebagai bytes (tanpa format/encode per tick)
+        self._message = value
+        encoding = sys.stdout.encoding or 'utf-8'
+        self._frames = [f"\r{value} {c}".encode(encoding, errors='replace') for c in _SPINNER_CHARS]
+        self._clear = b"\r" + b" " * (len(value) + 5) + b"\r"
 
     def start(self):
+        global _SPINNER_ACTIVE
         if not self.spinning:
-            self.spinning = True
-            self.thread = threading.Thread(target=self.spin, daemon=True)
-            self.thread.start()
+            _start_spinner_service()
+            sys.stdout.flush() # Frame ditulis ke .buffer, jadi keluarkan dulu sisa print()
+            with _SPINNER_LOCK:
+                self.spinning = True
+                _SPINNER_ACTIVE = self
+            _SPINNER_WAKE.set()
 
     def stop(self):
+        global _SPINNER_ACTIVE
         if self.spinning:
-            self.spinning = False
-            if self.thread:
-                self.thread.join()
+            # No join(): service thread cannot be mid-frame while we hold the lock
+            with _SPINNER_LOCK:
+                self.spinning = False
+                if _SPINNER_ACTIVE is self:
+                    _SPINNER_ACTIVE = None
+                sys.stdout.buffer.write(self._clear)
+                sys.stdout.flush()
+            _SPINNER_WAKE.set()
+
+# Buffered stream output: kumpulkan token, flush maksimal ~60x per detik
+_OUT_BUF = bytearray()
+_OUT_LOCK = threading.Lock()        # _OUT_BUF dipakai main thread & flusher
+_OUT_PENDING = threading.Event()    # Ada data tertahan di _OUT_BUF
+_OUT_FLUSHER = None
+_LAST_FLUSH = 0.0
+_FLUSH_INTERVAL = 1 / 60
+_FLUSH_BYTES = 4096
+
+def _flush_locked():
+    global _LAST_FLUSH
+    _LAST_FLUSH = time.monotonic()
+    _OUT_PENDING.clear()
+    if _OUT_BUF:
+        sys.stdout.flush() # Keluarkan dulu sisa text layer (print) biar urutannya benar
+        sys.stdout.buffer.write(_OUT_BUF)
+        sys.stdout.flush()
+        _OUT_BUF.clear()
+
+def _flush_loop():
+    # Deadline flush: chunk terakhir dari satu burst tampil paling lambat 1 frame kemudian,
+    # walau chunk berikutnya belum datang
+    while True:
+        _OUT_PENDING.wait()
+        delay = _LAST_FLUSH + _FLUSH_INTERVAL - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        with _OUT_LOCK:
+            if _OUT_PENDING.is_set():
+                _flush_locked()
+
+def _stream_flush():
+    with _OUT_LOCK:
+        _flush_locked()
+
+def _stream_write(text):
+    global _OUT_FLUSHER
+    with _OUT_LOCK:
+        _OUT_BUF.extend(text.encode(sys.stdout.encoding or 'utf-8', errors='replace'))
+        if len(_OUT_BUF) >= _FLUSH_BYTES or time.monotonic() - _LAST_FLUSH >= _FLUSH_INTERVAL:
+            _flush_locked()
+        elif _OUT_BUF:
+            if _OUT_FLUSHER is None:
+                _OUT_FLUSHER = threading.Thread(target=_flush_loop, daemon=True)
+                _OUT_FLUSHER.start()
+            _OUT_PENDING.set()
+
+# Markdown bold stripper: '*' terakhir di chunk ditahan dulu, siapa tahu pasangannya di chunk berikutnya
+_md_state = {'pending_star': False}
+
+def _strip_bold(text):
+    if not text:
+        return text
+    out = []
+    i = 0
+    if _md_state['pending_star']:
+        _md_state['pending_star'] = False
+        if text[0] == '*':
+            i = 1
+        else:
+            out.append('*')
+    n = len(text)
+    while True:
+        j = text.find('*', i)
+        if j == -1:
+            out.append(text[i:])
+            break
+        out.append(text[i:j])
+        if j + 1 == n:
+            _md_state['pending_star'] = True
+            break
+        if text[j + 1] == '*':
+            i = j + 2
+        else:
+            out.append('*')
+            i = j + 1
+    return ''.join(out)
+
+def _strip_bold_end():
+    """Keluarkan '*' yang masih tertahan di akhir response"""
+    if _md_state['pending_star']:
+        _md_state['pending_star'] = False
+        return '*'
+    return ''
+
+# Base64 encode file per chunk (57 KiB = kelipatan 3, jadi tidak ada padding di tengah)
+_B64_CHUNK = 57 * 1024
+
+def _b64encode_file(f):
+    buf = bytearray()
+    while chunk := f.read(_B64_CHUNK):
+        buf += base64.b64encode(chunk)
+    return buf.decode('ascii')
+
+# Ekstensi gambar umum (skip init database mimetypes untuk kasus biasa)
+_IMAGE_MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.webp': 'image/webp',
+    '.gif': 'image/gif',
+    '.heic': 'image/heic',
+    '.heif': 'image/heif',
+}
+
+def _guess_image_mime(filepath):
+    mime_type = _IMAGE_MIME_TYPES.get(os.path.splitext(filepath)[1].lower())
+    if mime_type:
+        return mime_type
+    mime_type, _ = mimetypes.guess_type(filepath)
+    return mime_type if (mime_type and mime_type.startswith('image')) else 'image/jpeg'
+
+# Footer TOS (konstan, dibangun sekali saat import)
+_TOS_TEXT = (
+    Text("Terms of Services and Privacy Notice for Gemini CLI\n", style="white")
+    + Text("https://github.com/google-gemini/gemini-cli/blob/main/docs/tos-privacy.md", style="blue underline")
+)
 
 # Helper for Boxed Menu
 def show_boxed_menu(title, subtitle, options):
     current_idx = 0
     
-    def generate_panel(idx):
-        menu_text = Text()
+    # Bagian statis (title/subtitle/footer) dibangun sekali, bukan per keystroke
+    header = Text()
+    
+    # Title with Green '?'
+    if title.startswith("?"):
+        header.append("? ", style="bold green")
+        header.append(title[1:].strip() + "\n\n", style="bold white")
+    else:
+        header.append(f"{title}\n\n", style="bold white")
         
-        # Title with Green '?'
-        if title.startswith("?"):
-            menu_text.append("? ", style="bold green")
-            menu_text.append(title[1:].strip() + "\n\n", style="bold white")
-        else:
-            menu_text.append(f"{title}\n\n", style="bold white")
-            
-        if subtitle:
-            menu_text.append(f"{subtitle}\n\n", style="white")
+    if subtitle:
+        header.append(f"{subtitle}\n\n", style="white")
+    
+    footer = Text("\n(Use Enter to select)\n\n", style="dim white")
+    footer.append_text(_TOS_TEXT)
+    
+    def generate_panel(idx):
+        menu_text = header.copy()
         
         for i, option in enumerate(options):
             if i == idx:
@@ -93,9 +275,7 @@ def show_boxed_menu(title, subtitle, options):
             else:
                 menu_text.append(f"  {option}\n", style="white")
         
-        menu_text.append("\n(Use Enter to select)\n\n", style="dim white")
-        menu_text.append("Terms of Services and Privacy Notice for Gemini CLI\n", style="white")
-        menu_text.append("https://github.com/google-gemini/gemini-cli/blob/main/docs/tos-privacy.md", style="blue underline")
+        menu_text.append_text(footer)
 
         return Panel(
             menu_text,
@@ -109,29 +289,271 @@ def show_boxed_menu(title, subtitle, options):
     with Live(generate_panel(current_idx), auto_refresh=False, transient=True) as live:
         # Flush buffer to prevent accidental selection from previous Enter
         while msvcrt.kbhit():
-            msvcrt.getch()
+            msvcrt.getwch()
             
+        digit_keys = [str(i+1) for i in range(len(options))]
+        prev_idx = current_idx # Panel awal sudah dirender oleh Live()
         while True:
-            live.update(generate_panel(current_idx), refresh=True)
+            # Re-render hanya kalau pilihan berubah
+            if current_idx != prev_idx:
+                live.update(generate_panel(current_idx), refresh=True)
+                prev_idx = current_idx
             
-            # Input Handling
+            # Input Handling (getwch blocks di level OS, tidak ada polling)
             try:
-                key = msvcrt.getch()
-                if key == b'\xe0': # Arrow key prefix
-                    key = msvcrt.getch()
-                    if key == b'H': # Up
+                key = msvcrt.getwch()
+                if key in ('\xe0', '\x00'): # Arrow/special key prefix
+                    key = msvcrt.getwch()
+                    if key == 'H': # Up
                         current_idx = (current_idx - 1) % len(options)
-                    elif key == b'P': # Down
+                    elif key == 'P': # Down
                         current_idx = (current_idx + 1) % len(options)
-                elif key == b'\r': # Enter
+                elif key == '\r': # Enter
                     return current_idx
-                elif key == b'\x03': # Ctrl+C
+                elif key == '\x03': # Ctrl+C
                     raise KeyboardInterrupt
-                elif key in [str(i+1).encode() for i in range(len(options))]:
+                elif key in digit_keys:
                      current_idx = int(key) - 1
             except KeyboardInterrupt:
                 raise
 
+# --- COMMAND HANDLERS ---
+# Setiap handler menerima (rest, state): rest = teks setelah nama command,
+# state = dict mutable berisi client/chat/model/pending_media/args.
+# Return True untuk keluar dari chat loop.
+
+def _h_exit(rest, state):
+    print("Goodbye!")
+    return True
+
+def _h_clear(rest, state):
+    chat = state['chat']
+    chat.reset()
+    chat.model = state['model']
+    chat.system_instruction = None
+    state['pending_media'].clear()
+    print(f"{Colors.WARNING}Context cleared.{Colors.ENDC}")
+
+def _h_image(rest, state):
+    try:
+        filepath = rest.strip()
+        if not filepath:
+            print(f"{Colors.FAIL}Usage: /image <path>{Colors.ENDC}")
+        elif os.path.exists(filepath):
+            mime_type = _guess_image_mime(filepath)
+            with open(filepath, "rb") as image_file:
+                encoded_string = _b64encode_file(image_file)
+                state['pending_media'].append({
+                    'mime_type': mime_type, 
+                    'data': encoded_string
+                })
+                print(f"{Colors.GREEN}Image attached ({mime_type})! It will be sent with your next message.{Colors.ENDC}")
+        else:
+            print(f"{Colors.FAIL}File not found: {filepath}{Colors.ENDC}")
+    except Exception as e:
+        print(f"{Colors.FAIL}Error reading image: {e}{Colors.ENDC}")
+
+def _h_video(rest, state):
+    try:
+        filepath = rest.strip()
+        if not filepath:
+            print(f"{Colors.FAIL}Usage: /video <path>{Colors.ENDC}")
+        elif os.path.exists(filepath):
+            file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
+            if file_size_mb > 20:
+                print(f"{Colors.WARNING}Warning: Video size is {file_size_mb:.1f}MB. Large files might fail or timeout.{Colors.ENDC}")
+            
+            mime_type, _ = mimetypes.guess_type(filepath)
+            if not mime_type or not mime_type.startswith('video'):
+                mime_type = 'video/mp4' 
+                
+            with open(filepath, "rb") as video_file:
+                encoded_string = _b64encode_file(video_file)
+                state['pending_media'].append({
+                    'mime_type': mime_type,
+                    'data': encoded_string
+                })
+                print(f"{Colors.GREEN}Video attached ({mime_type})! It will be sent with your next message.{Colors.ENDC}")
+        else:
+            print(f"{Colors.FAIL}File not found: {filepath}{Colors.ENDC}")
+    except Exception as e:
+        print(f"{Colors.FAIL}Error reading video: {e}{Colors.ENDC}")
+
+def _h_model(rest, state):
+    try:
+        new_model = rest.split()[0]
+        state['chat'].model = new_model
+        print(f"{Colors.WARNING}Switched to model: {new_model}{Colors.ENDC}")
+    except IndexError:
+        print(f"{Colors.FAIL}Usage: /model <model_name>{Colors.ENDC}")
+
+def _h_temperature(rest, state):
+    try:
+        temperature = float(rest.split()[0])
+        if not 0.0 <= temperature <= 2.0:
+            raise ValueError
+    except (IndexError, ValueError):
+        print(f"{Colors.FAIL}Usage: /temperature <0.0-2.0> (current: {state['chat'].temperature}){Colors.ENDC}")
+        return
+    state['chat'].temperature = temperature
+    print(f"{Colors.WARNING}Temperature set to: {temperature}{Colors.ENDC}")
+    if temperature <= RESPONSE_CACHE_MAX_TEMPERATURE:
+        print(f"{Colors.CYAN}Response cache is active (temperature <= {RESPONSE_CACHE_MAX_TEMPERATURE}).{Colors.ENDC}")
+
+def _h_mcp(rest, state):
+    parts = rest.split(' ')
+    if len(parts) >= 2 and parts[0] == 'connect':
+        server_cmd = parts[1]
+        server_args = parts[2:]
+        print(f"{Colors.CYAN}Connecting to MCP Server: {server_cmd} {server_args}...{Colors.ENDC}")
+        mcp_client = MCPClient(server_cmd, server_args)
+        if mcp_client.connect():
+            registry.register_mcp(mcp_client)
+            print(f"{Colors.GREEN}Successfully connected! Discovered tools:{Colors.ENDC}")
+            for tool in mcp_client.tools:
+                print(f"  - {tool['name']}: {tool.get('description', '')[:50]}...")
+        else:
+            print(f"{Colors.FAIL}Failed to connect to MCP Server.{Colors.ENDC}")
+    else:
+        print("Usage: /mcp connect <command> [args...]")
+
+def _h_persona(rest, state):
+    try:
+        persona_name = rest.split()[0]
+        new_instruction = get_persona(persona_name)
+        chat = state['chat']
+        chat.system_instruction = new_instruction
+        chat.reset()
+        print(f"{Colors.WARNING}Switched to persona: {persona_name}{Colors.ENDC}")
+        print(f"{Colors.CYAN}Context cleared to apply new persona.{Colors.ENDC}")
+    except IndexError:
+        print(f"{Colors.FAIL}Usage: /persona <name>{Colors.ENDC}")
+
+def _h_load(rest, state):
+    try:
+        filepath = rest.strip()
+        if not filepath:
+            print(f"{Colors.FAIL}Usage: /load <path>{Colors.ENDC}")
+        elif os.path.exists(filepath):
+            with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
+                content = f.read()
+            content_len = len(content)
+            context_msg = "".join((
+                "Context loaded from file '", filepath, "':\n\n```\n",
+                content,
+                "\n```\n\nPlease use this context for future questions."
+            ))
+            del content # Lepas salinan mentah, yang disimpan cukup context_msg
+            chat = state['chat']
+            chat.history.append({"role": "user", "parts": [{"text": context_msg}]})
+            chat.history.append({"role": "model", "parts": [{"text": f"Understood. I have loaded the context from '{filepath}'."}]})
+            print(f"{Colors.GREEN}Successfully loaded '{filepath}' ({content_len} chars) into context.{Colors.ENDC}")
+        else:
+            print(f"{Colors.FAIL}File not found: {filepath}{Colors.ENDC}")
+    except Exception as e:
+        print(f"{Colors.FAIL}Error reading file: {e}{Colors.ENDC}")
+
+def _h_safe(rest, state):
+    config.SAFE_MODE = not config.SAFE_MODE
+    status = "ON" if config.SAFE_MODE else "OFF"
+    color = Colors.GREEN if config.SAFE_MODE else Colors.FAIL
+    print(f"{Colors.WARNING}Safe Mode is now: {color}{status}{Colors.ENDC}")
+
+def _h_auth(rest, state):
+    # Auto-Logout / Clean Slate
+    subtitle_extra = ""
+    if os.path.exists(DEFAULT_CREDENTIALS_FILE):
+        try:
+            os.remove(DEFAULT_CREDENTIALS_FILE)
+            subtitle_extra = " (Session cleared)"
+        except Exception as e:
+            print(f"{Colors.FAIL}Failed to clear session: {e}{Colors.ENDC}")
+    # Cache onboarding (project_id/tier) milik akun lama juga dibuang
+    state['client'].clear_session_cache()
+    
+    # Interactive Menu
+    try:
+        # Small delay to ensure input buffer is ready for flushing
+        time.sleep(0.2)
+        
+        idx = show_boxed_menu(
+            "? Authentication",
+            f"How would you like to authenticate?{subtitle_extra}",
+            ["1. Login with Google", "2. Use Gemini API Key", "3. Vertex AI"]
+        )
+        
+        new_mode = None
+        new_key = None
+        new_project = None
+        new_location = 'us-central1'
+        
+        if idx == 0: # Login
+            new_mode = 'oauth'
+        elif idx == 1: # API Key
+            new_mode = 'apikey'
+            new_key = input("Enter Gemini API Key: ").strip()
+        elif idx == 2: # Vertex
+            new_mode = 'vertex'
+            new_project = input("Enter Google Cloud Project ID: ").strip()
+            new_location = input("Enter Location (default: us-central1): ").strip() or 'us-central1'
+        
+        # Re-initialize Client
+        print(f"{Colors.CYAN}Re-initializing client ({new_mode})...{Colors.ENDC}")
+        client = GeminiClient(
+            DEFAULT_CREDENTIALS_FILE,
+            auth_mode=new_mode,
+            api_key=new_key,
+            vertex_project=new_project,
+            vertex_location=new_location
+        )
+        
+        # Force login if oauth
+        if new_mode == 'oauth':
+             client.auth.authenticate(force_login=True)
+             
+        client.setup_user()
+        
+        # Update Client & Chat Session
+        state['chat'].close()
+        state['client'].close()
+        state['client'] = client
+        state['chat'] = ChatSession(client, model=state['model'])
+        
+        # Update Args (for debug/status)
+        args = state['args']
+        args.mode = new_mode
+        args.key = new_key
+        args.project = new_project
+        args.location = new_location
+
+        project_info = client.project_id if client.project_id else (args.project if args.mode == 'vertex' else 'N/A')
+        if args.debug:
+            print(f"{Colors.GREEN}Authentication successful! Project: {project_info}{Colors.ENDC}")
+        else:
+            print(f"{Colors.GREEN}Authentication successful!{Colors.ENDC}")
+            
+    except KeyboardInterrupt:
+        # Re-raise to trigger main loop's interactive exit prompt
+        raise
+    except Exception as e:
+        print(f"{Colors.FAIL}Authentication failed: {e}{Colors.ENDC}")
+
+# Command dispatch table (lookup O(1) berdasarkan nama command)
+HANDLERS = {
+    '/exit': _h_exit,
+    '/quit': _h_exit,
+    '/clear': _h_clear,
+    '/image': _h_image,
+    '/video': _h_video,
+    '/model': _h_model,
+    '/temperature': _h_temperature,
+    '/mcp': _h_mcp,
+    '/persona': _h_persona,
+    '/load': _h_load,
+    '/safe': _h_safe,
+    '/auth': _h_auth,
+}
+
 def main():
     import argparse
     
@@ -214,13 +636,19 @@ def main():
 
     # 2. Init Chat Session
     model = 'gemini-3-pro-preview'
-    chat = ChatSession(client, model=model)
-    pending_media = [] # Store media (images/video) to be sent with next message
+    state = {
+        'args': args,
+        'client': client,
+        'model': model,
+        'chat': ChatSession(client, model=model),
+        'pending_media': [], # Store media (images/video) to be sent with next message
+    }
     
     print(f"\nType '/exit' to quit, '/clear' to reset context.")
     print(f"Using model: {Colors.BOLD}{model}{Colors.ENDC}\n")
 
     # 3. Chat Loop
+    _start_spinner_service()
     last_interrupt_time = 0
     while True:
         try:
@@ -228,209 +656,13 @@ def main():
             
             if not user_input:
                 continue
-                
-            if user_input.lower() in ['/exit', '/quit']:
-                print("Goodbye!")
-                break
-                
-            if user_input.lower() == '/clear':
-                chat = ChatSession(client, model=model)
-                pending_media = []
-                print(f"{Colors.WARNING}Context cleared.{Colors.ENDC}")
-                continue
 
             # --- COMMANDS ---
-            
-            if user_input.lower().startswith('/image '):
-                # ... (kode image tetap sama) ...
-                try:
-                    filepath = user_input.split(' ', 1)[1].strip()
-                    if os.path.exists(filepath):
-                        import base64
-                        with open(filepath, "rb") as image_file:
-                            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                            pending_media.append({
-                                'mime_type': 'image/jpeg', 
-                                'data': encoded_string
-                            })
-                            print(f"{Colors.GREEN}Image attached! It will be sent with your next message.{Colors.ENDC}")
-                    else:
-                        print(f"{Colors.FAIL}File not found: {filepath}{Colors.ENDC}")
-                except Exception as e:
-                    print(f"{Colors.FAIL}Error reading image: {e}{Colors.ENDC}")
-                continue
-
-            if user_input.lower().startswith('/video '):
-                # ... (kode video tetap sama) ...
-                try:
-                    filepath = user_input.split(' ', 1)[1].strip()
-                    if os.path.exists(filepath):
-                        file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
-                        if file_size_mb > 20:
-                            print(f"{Colors.WARNING}Warning: Video size is {file_size_mb:.1f}MB. Large files might fail or timeout.{Colors.ENDC}")
-                        
-                        import base64
-                        import mimetypes
-                        mime_type, _ = mimetypes.guess_type(filepath)
-                        if not mime_type or not mime_type.startswith('video'):
-                            mime_type = 'video/mp4' 
-                            
-                        with open(filepath, "rb") as video_file:
-                            encoded_string = base64.b64encode(video_file.read()).decode('utf-8')
-                            pending_media.append({
-                                'mime_type': mime_type,
-                                'data': encoded_string
-                            })
-                            print(f"{Colors.GREEN}Video attached ({mime_type})! It will be sent with your next message.{Colors.ENDC}")
-                    else:
-                        print(f"{Colors.FAIL}File not found: {filepath}{Colors.ENDC}")
-                except Exception as e:
-                    print(f"{Colors.FAIL}Error reading video: {e}{Colors.ENDC}")
-                continue
-
-            if user_input.lower().startswith('/model '):
-                # ... (kode model tetap sama) ...
-                try:
-                    new_model = user_input.split(' ')[1]
-                    chat.model = new_model
-                    print(f"{Colors.WARNING}Switched to model: {new_model}{Colors.ENDC}")
-                except IndexError:
-                    print(f"{Colors.FAIL}Usage: /model <model_name>{Colors.ENDC}")
-                continue
-
-            if user_input.lower().startswith('/mcp '):
-                # ... (kode mcp tetap sama) ...
-                parts = user_input.split(' ')
-                if len(parts) >= 3 and parts[1] == 'connect':
-                    cmd = parts[2]
-                    args = parts[3:]
-                    print(f"{Colors.CYAN}Connecting to MCP Server: {cmd} {args}...{Colors.ENDC}")
-                    from gemini_core.mcp import MCPClient
-                    from gemini_core.tools import registry
-                    mcp_client = MCPClient(cmd, args)
-                    if mcp_client.connect():
-                        registry.register_mcp(mcp_client)
-                        print(f"{Colors.GREEN}Successfully connected! Discovered tools:{Colors.ENDC}")
-                        for tool in mcp_client.tools:
-                            print(f"  - {tool['name']}: {tool.get('description', '')[:50]}...")
-                    else:
-                        print(f"{Colors.FAIL}Failed to connect to MCP Server.{Colors.ENDC}")
-                else:
-                    print("Usage: /mcp connect <command> [args...]")
-                continue
-
-            if user_input.lower().startswith('/persona '):
-                # ... (kode persona tetap sama) ...
-                try:
-                    persona_name = user_input.split(' ')[1]
-                    from gemini_core.personas import get_persona
-                    new_instruction = get_persona(persona_name)
-                    chat.system_instruction = new_instruction
-                    chat.history = [] 
-                    print(f"{Colors.WARNING}Switched to persona: {persona_name}{Colors.ENDC}")
-                    print(f"{Colors.CYAN}Context cleared to apply new persona.{Colors.ENDC}")
-                except IndexError:
-                    print(f"{Colors.FAIL}Usage: /persona <name>{Colors.ENDC}")
-                continue
-
-            if user_input.lower().startswith('/load '):
-                # ... (kode load tetap sama) ...
-                try:
-                    filepath = user_input.split(' ', 1)[1].strip()
-                    if os.path.exists(filepath):
-                        with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-                            content = f.read()
-                        context_msg = f"Context loaded from file '{filepath}':\n\n```\n{content}\n```\n\nPlease use this context for future questions."
-                        chat.history.append({"role": "user", "parts": [{"text": context_msg}]})
-                        chat.history.append({"role": "model", "parts": [{"text": f"Understood. I have loaded the context from '{filepath}'."}]})
-                        print(f"{Colors.GREEN}Successfully loaded '{filepath}' ({len(content)} chars) into context.{Colors.ENDC}")
-                    else:
-                        print(f"{Colors.FAIL}File not found: {filepath}{Colors.ENDC}")
-                except Exception as e:
-                    print(f"{Colors.FAIL}Error reading file: {e}{Colors.ENDC}")
-                continue
-
-            if user_input.lower() == '/safe':
-                import gemini_core.config as config
-                config.SAFE_MODE = not config.SAFE_MODE
-                status = "ON" if config.SAFE_MODE else "OFF"
-                color = Colors.GREEN if config.SAFE_MODE else Colors.FAIL
-                print(f"{Colors.WARNING}Safe Mode is now: {color}{status}{Colors.ENDC}")
-                continue
-
-            if user_input.lower().startswith('/auth'):
-                # Auto-Logout / Clean Slate
-                subtitle_extra = ""
-                if os.path.exists(DEFAULT_CREDENTIALS_FILE):
-                    try:
-                        os.remove(DEFAULT_CREDENTIALS_FILE)
-                        subtitle_extra = " (Session cleared)"
-                    except Exception as e:
-                        print(f"{Colors.FAIL}Failed to clear session: {e}{Colors.ENDC}")
-                
-                # Interactive Menu
-                try:
-                    # Small delay to ensure input buffer is ready for flushing
-                    time.sleep(0.2)
-                    
-                    idx = show_boxed_menu(
-                        "? Authentication",
-                        f"How would you like to authenticate?{subtitle_extra}",
-                        ["1. Login with Google", "2. Use Gemini API Key", "3. Vertex AI"]
-                    )
-                    
-                    new_mode = None
-                    new_key = None
-                    new_project = None
-                    new_location = 'us-central1'
-                    
-                    if idx == 0: # Login
-                        new_mode = 'oauth'
-                    elif idx == 1: # API Key
-                        new_mode = 'apikey'
-                        new_key = input("Enter Gemini API Key: ").strip()
-                    elif idx == 2: # Vertex
-                        new_mode = 'vertex'
-                        new_project = input("Enter Google Cloud Project ID: ").strip()
-                        new_location = input("Enter Location (default: us-central1): ").strip() or 'us-central1'
-                    
-                    # Re-initialize Client
-                    print(f"{Colors.CYAN}Re-initializing client ({new_mode})...{Colors.ENDC}")
-                    client = GeminiClient(
-                        DEFAULT_CREDENTIALS_FILE,
-                        auth_mode=new_mode,
-                        api_key=new_key,
-                        vertex_project=new_project,
-                        vertex_location=new_location
-                    )
-                    
-                    # Force login if oauth
-                    if new_mode == 'oauth':
-                         client.auth.authenticate(force_login=True)
-                         
-                    client.setup_user()
-                    
-                    # Update Chat Session
-                    chat = ChatSession(client, model=model)
-                    
-                    # Update Args (for debug/status)
-                    args.mode = new_mode
-                    args.key = new_key
-                    args.project = new_project
-                    args.location = new_location
-
-                    project_info = client.project_id if client.project_id else (args.project if args.mode == 'vertex' else 'N/A')
-                    if args.debug:
-                        print(f"{Colors.GREEN}Authentication successful! Project: {project_info}{Colors.ENDC}")
-                    else:
-                        print(f"{Colors.GREEN}Authentication successful!{Colors.ENDC}")
-                        
-                except KeyboardInterrupt:
-                    # Re-raise to trigger main loop's interactive exit prompt
-                    raise
-                except Exception as e:
-                    print(f"{Colors.FAIL}Authentication failed: {e}{Colors.ENDC}")
-                
+            name, _, rest = user_input.partition(' ')
+            handler = HANDLERS.get(name.lower())
+            if handler:
+                if handler(rest, state):
+                    break
                 continue
 
             # --- CHAT & STREAMING ---
@@ -445,10 +677,12 @@ def main():
             def on_stream(text):
                 nonlocal first_token_received
                 
-                # Handle Tool Execution Logs
-                if text.startswith('[Running tool:'):
+                # Handle Tool Execution Logs (chat mengirimnya diawali '\n')
+                stripped = text.lstrip()
+                if stripped.startswith('[Running tool:'):
+                    _stream_flush() # Text tertahan harus keluar sebelum print / prompt konfirmasi Safe Mode
                     spinner.stop() # Clear spinner line
-                    tool_info = text.replace('[Running tool:', '').strip(']')
+                    tool_info = stripped.replace('[Running tool:', '').strip().strip(']')
                     print(f"\n{Colors.WARNING}⠹ Proceeding with Execution: {tool_info}{Colors.ENDC}")
                     # Restart spinner with new status
                     spinner.message = f"{Colors.CYAN}Executing tool...{Colors.ENDC}"
@@ -456,7 +690,8 @@ def main():
                     return
 
                 # Handle Tool Results
-                if text.startswith('[Result:'):
+                if stripped.startswith('[Result:'):
+                    _stream_flush()
                     spinner.stop() # Clear spinner line
                     print(f"{Colors.CYAN}{text}{Colors.ENDC}")
                     # Restart spinner with new status
@@ -472,20 +707,24 @@ def main():
                     first_token_received = True
                 
                 # Strip markdown bolding (**) as requested
-                clean_text = text.replace('**', '')
-                print(clean_text, end='', flush=True)
+                clean_text = _strip_bold(text)
+                _stream_write(clean_text)
             
             try:
-                response = chat.send_message(user_input, media_items=pending_media, stream_callback=on_stream)
+                response = state['chat'].send_message(user_input, media_items=state['pending_media'], stream_callback=on_stream)
             except KeyboardInterrupt:
+                # Sisa buffer keluar dulu, baru pesan cancel
+                _stream_write(_strip_bold_end())
+                _stream_flush()
                 print(f"\n{Colors.WARNING}Generation cancelled by user.{Colors.ENDC}")
             finally:
+                _stream_write(_strip_bold_end())
+                _stream_flush()
                 spinner.stop() # Ensure stopped if no stream or interrupted
                 if not first_token_received:
                      print(f"{Colors.GREEN}Gemini > {Colors.ENDC}", end='', flush=True)
             
-            if pending_media:
-                pending_media = []
+            state['pending_media'].clear()
             
             print()
             
@@ -515,5 +754,8 @@ def main():
         except Exception as e:
             print(f"\n{Colors.FAIL}Error: {e}{Colors.ENDC}")
 
+    state['chat'].close()
+    state['client'].close()
+
 if __name__ == "__main__":
     main()
@@ -1,7 +1,7 @@
 import os
-import json
 import socket
 import logging
+import threading
 import webbrowser
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse, parse_qs
@@ -10,6 +10,7 @@ from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 
+from . import fastjson
 from .config import (
     OAUTH_CLIENT_ID, OAUTH_CLIENT_SECRET, OAUTH_SCOPES,
     SIGN_IN_SUCCESS_URL, SIGN_IN_FAILURE_URL
@@ -38,6 +39,15 @@ class OAuthCallbackHandler(BaseHTTPRequestHandler):
             self.send_header('Location', SIGN_IN_FAILURE_URL)
             self.end_headers()
             self.server.auth_code = None
+        self.server.auth_done.set()
+
+def _serve_until_done(server):
+    """Blocking handle_request sampai callback OAuth diterima (jalan di helper thread)"""
+    try:
+        while not server.auth_done.is_set():
+            server.handle_request()
+    except (OSError, ValueError):
+        pass # Socket ditutup dari main thread (login dibatalkan)
 
 class GoogleAuth:
     def __init__(self, credentials_file):
@@ -45,11 +55,11 @@ class GoogleAuth:
         self.creds = None
 
     def _get_free_port(self):
-        sock = socket.socket()
-        sock.bind(('localhost', 0))
-        port = sock.getsockname()[1]
-        sock.close()
-        return port
+        # Context manager: socket selalu ditutup walau getsockname gagal
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('localhost', 0))
+            return sock.getsockname()[1]
 
     def authenticate(self, force_login=False):
         """
@@ -58,12 +68,20 @@ class GoogleAuth:
         2. Jika expired, refresh
         3. Jika tidak ada/invalid, mulai login flow baru
         """
-        # 1. Cek Token Cache
-        if not force_login and os.path.exists(self.credentials_file):
+        # 1. Cek Token Cache (satu open, tanpa os.path.exists terpisah)
+        data = None
+        if not force_login:
+            try:
+                with open(self.credentials_file, 'rb') as f:
+                    data = fastjson.loads(f.read())
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Error loading saved credentials: {e}")
+        
+        if data:
             try:
-                with open(self.credentials_file, 'r') as f:
-                    data = json.load(f)
-                    self.creds = Credentials.from_authorized_user_info(data, OAUTH_SCOPES)
+                self.creds = Credentials.from_authorized_user_info(data, OAUTH_SCOPES)
                 
                 if self.creds.valid:
                     return self.creds
@@ -104,13 +122,16 @@ class GoogleAuth:
         webbrowser.open(auth_url)
         
         server = HTTPServer(('localhost', port), OAuthCallbackHandler)
-        server.timeout = 1 # Check for interrupt every 1 second
+        server.auth_code = None
+        server.auth_done = threading.Event()
+        threading.Thread(target=_serve_until_done, args=(server,), daemon=True).start()
         try:
-            # Loop until auth_code is received or interrupted
-            while not getattr(server, 'auth_code', None):
-                server.handle_request()
+            # POSIX: Event.wait() tanpa timeout tetap bisa di-interrupt Ctrl+C.
+            # Windows: lock wait tidak interruptible, jadi cek ulang tiap 0.2s.
+            wait_timeout = 0.2 if os.name == 'nt' else None
+            while not server.auth_done.wait(wait_timeout):
+                pass
         except KeyboardInterrupt:
-            server.server_close()
             print("\nLogin cancelled by user.")
             raise Exception("Login cancelled by user.")
         finally:
@@ -137,5 +158,8 @@ class GoogleAuth:
 
     def _save_credentials(self):
         if self.creds:
-            with open(self.credentials_file, 'w') as f:
+            # Tulis ke file sementara lalu os.replace (atomic), biar token tidak korup kalau crash/Ctrl+C
+            tmp = self.credentials_file + ".tmp"
+            with open(tmp, 'w') as f:
                 f.write(self.creds.to_json())
+            os.replace(tmp, self.credentials_file)
@@ -1,9 +1,45 @@
+import copy
+import functools
+import hashlib
 import logging
+import secrets
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from . import fastjson
+from .personas import get_persona
 from .tools import registry
 
 logger = logging.getLogger(__name__)
 
+CACHE_TTL_SECONDS = 3600
+# Server menolak cachedContents di bawah minimum token (>= 1024 token tergantung model, ~4 byte/token).
+# Prefix yang jelas lebih kecil tidak dicoba, supaya tidak buang satu round trip yang pasti gagal
+CACHE_MIN_PREFIX_BYTES = 4096
+
+# Sliding window history: kalau estimasi token lewat batas, turn lama diringkas
+MAX_HISTORY_TOKENS = 32000
+KEEP_RECENT_TURNS = 4 # Jumlah turn user terakhir yang disimpan verbatim
+MEDIA_PART_TOKENS = 258 # inlineData dihitung biaya tetap, bukan panjang base64-nya
+
+# Response cache (LRU in-process), hanya untuk request yang (hampir) deterministik:
+# aktif kalau temperature session <= RESPONSE_CACHE_MAX_TEMPERATURE (default session 0.7 = tidak aktif,
+# turunkan lewat /temperature di CLI)
+RESPONSE_CACHE_SIZE = 64
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.2
+
+# Batas hasil tool yang masuk history (dikirim ulang tiap turn); sisanya di-elide
+MAX_TOOL_RESULT_CHARS = 8000
+TOOL_RESULT_HEAD_CHARS = 4000
+TOOL_RESULT_TAIL_CHARS = 2000
+
+# Pool untuk eksekusi tool paralel (thread dibuat lazy oleh executor)
+_TOOL_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tool")
+
+# Jumlah session (induk + cabang fork) yang memegang tiap handle cachedContents.
+# Handle baru dihapus di server setelah pemegang terakhir melepasnya
+_CACHE_REFS = {}
+
 class ChatSession:
     def __init__(self, client, model='gemini-3-pro-preview', system_instruction=None):
         self.client = client
@@ -11,37 +47,358 @@ class ChatSession:
         self.system_instruction = system_instruction
         self.history = [] # List of content objects
         self.tools = registry
+        self.max_history_tokens = MAX_HISTORY_TOKENS
+        self.temperature = 0.7
+        self._response_cache = OrderedDict() # fingerprint -> response dict
+        self.tool_result_store = {} # call_id -> hasil tool lengkap (yang di-elide di history)
+        self._pending_compaction = None # (future summary, prefix content yang diringkas)
+        
+        # Handle cachedContents untuk prefix statis (system instruction + tools)
+        self.cached_content = None
+        self._cache_key = None
+        self._cache_expires = 0.0
+        
+        # Blok statis per session: dibangun ulang hanya kalau registry/persona berubah
+        self._tools_block = None
+        self._tools_block_bytes = None
+        self._system_instruction_src = None
+        self._system_instruction_block = None
+        
+        # Branch: session hasil fork() menyimpan referensi ke session induknya
+        self.parent = None
+
+    def reset(self):
+        """Kosongkan history percakapan (in-place, tanpa bikin session baru)"""
+        self.history.clear()
+        self.tool_result_store.clear()
+        self._pending_compaction = None
+
+    def fork(self):
+        """
+        Buat cabang percakapan dari state saat ini. Content history dipakai bersama (tidak di-deep-copy),
+        handle cachedContents & blok tools/system instruction ikut diwarisi sehingga cabang
+        langsung memakai prefix yang sudah di-cache server.
+        """
+        branch = copy.copy(self)
+        branch.history = list(self.history) # Hanya list of references
+        branch.parent = self
+        branch._hold_cached_content(self.cached_content) # Induk & cabang sama-sama memegang handle
+        # State mutable milik sendiri, supaya reset()/compaction di cabang tidak mengubah induk
+        branch.tool_result_store = dict(self.tool_result_store)
+        branch._response_cache = OrderedDict(self._response_cache)
+        branch._pending_compaction = None
+        return branch
+
+    def commit(self):
+        """Gabungkan cabang ini kembali ke induknya (history induk diganti history cabang)"""
+        if self.parent is None:
+            raise ValueError("Session ini bukan hasil fork()")
+        parent = self.parent
+        parent.history[:] = self.history
+        parent.tool_result_store.update(self.tool_result_store)
+        # Cache handle cabang lebih baru kalau sempat dibuat ulang
+        if self.cached_content != parent.cached_content:
+            parent._release_cached_content()
+            parent._hold_cached_content(self.cached_content)
+        parent._cache_key = self._cache_key
+        parent._cache_expires = self._cache_expires
+        self.drop()
+        return parent
+
+    def drop(self):
+        """Buang cabang ini tanpa mengubah induknya"""
+        if self.parent is None:
+            raise ValueError("Session ini bukan hasil fork()")
+        self._release_cached_content()
+        self.history = []
+        self.parent = None
+
+    def close(self):
+        """Lepas resource server-side session ini (handle cachedContents). Sinkron: dipanggil sebelum client ditutup"""
+        self._release_cached_content(wait=True)
+
+
+    def _get_tools_block(self):
+        """Definisi tools (dict + bytes ter-serialisasi), bytes dibangun ulang hanya kalau registry mengembalikan object baru"""
+        tools_block = self.tools.get_tool_definitions()
+        if tools_block is not self._tools_block:
+            self._tools_block = tools_block
+            self._tools_block_bytes = fastjson.dumps(self._tools_block, sort_keys=True)
+        return self._tools_block
 
-    # ... (send_message method tetap sama) ...
+    def _get_system_instruction_block(self):
+        """Blok systemInstruction, dibangun ulang hanya kalau persona berubah"""
+        if self.system_instruction != self._system_instruction_src:
+            self._system_instruction_src = self.system_instruction
+            self._system_instruction_block = {
+                "parts": [{"text": self.system_instruction}]
+            } if self.system_instruction else None
+        return self._system_instruction_block
+
+    def _get_cached_content(self, tools_block):
+        """Ambil (atau buat ulang) handle cachedContents jika model/persona/tools berubah"""
+        key = (self.model, self.system_instruction, self._tools_block_bytes)
+        if key != self._cache_key or time.monotonic() >= self._cache_expires:
+            self._cache_key = key
+            self._release_cached_content()
+            
+            prefix_bytes = len(self._tools_block_bytes) + len((self.system_instruction or '').encode('utf-8'))
+            if prefix_bytes < CACHE_MIN_PREFIX_BYTES:
+                self.cached_content = None
+            else:
+                self._hold_cached_content(self.client.create_cached_content(
+                    self.model,
+                    system_instruction=self.system_instruction,
+                    tools=tools_block,
+                    ttl_seconds=CACHE_TTL_SECONDS
+                ))
+            # Refresh sedikit sebelum TTL habis; kalau gagal, tidak dicoba lagi sampai key berubah
+            self._cache_expires = time.monotonic() + CACHE_TTL_SECONDS - 300 if self.cached_content else float('inf')
+        return self.cached_content
 
-    def _generate_with_history(self):
-        """Internal helper untuk call API dengan full history"""
+    def _hold_cached_content(self, name):
+        """Pasang handle cachedContents di session ini dan tambah reference count-nya"""
+        self.cached_content = name
+        if name:
+            _CACHE_REFS[name] = _CACHE_REFS.get(name, 0) + 1
+
+    def _release_cached_content(self, wait=False):
+        """
+        Lepas handle cachedContents session ini. Handle dihapus di server (background, atau sinkron
+        kalau wait=True) hanya kalau tidak ada session lain (induk/cabang fork) yang masih memakainya.
+        """
+        name = self.cached_content
+        self.cached_content = None
+        if not name:
+            return
+        refs = _CACHE_REFS.pop(name, 1) - 1
+        if refs > 0:
+            _CACHE_REFS[name] = refs
+        elif wait:
+            self.client.delete_cached_content(name)
+        else:
+            _TOOL_POOL.submit(self.client.delete_cached_content, name)
+
+    def _generate_with_history(self, stream_callback=None):
+        """Internal helper untuk call API dengan full history (text di-stream ke stream_callback)"""
         if not self.client.session_setup:
             self.client.setup_user()
             
+        tools_block = self._get_tools_block()
+        
+        # Response cache dicek dulu: cache hit tidak perlu membuat/refresh handle cachedContents
+        cache_key = None
+        if self.temperature <= RESPONSE_CACHE_MAX_TEMPERATURE:
+            cache_key = self._response_cache_key()
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Response cache hit")
+                self._response_cache.move_to_end(cache_key)
+                if stream_callback and cached['text']:
+                    stream_callback(cached['text'])
+                return cached
+        
+        cached_content = self._get_cached_content(tools_block)
+        
         request_payload = {
             "contents": self.history,
             "generationConfig": {
-                "temperature": 0.7,
+                "temperature": self.temperature,
                 "maxOutputTokens": 4096,
-            },
-            "tools": [self.tools.get_tool_definitions()]
+            }
         }
 
-        # Inject System Instruction
-        if self.system_instruction:
-            request_payload["systemInstruction"] = {
-                "parts": [{"text": self.system_instruction}]
-            }
+        if cached_content:
+            # System instruction & tools sudah ada di cache server
+            request_payload["cachedContent"] = cached_content
+        else:
+            request_payload["tools"] = [tools_block]
+
+            # Inject System Instruction
+            system_instruction_block = self._get_system_instruction_block()
+            if system_instruction_block:
+                request_payload["systemInstruction"] = system_instruction_block
 
         payload = {
             "model": self.model,
             "project": self.client.project_id,
-            "user_prompt_id": f"chat-{int(time.time() * 1000)}",
+            "user_prompt_id": f"chat-{secrets.token_hex(8)}",
             "request": request_payload
         }
         
-        return self.client._request_generate(payload)
+        response = self.client._request_generate(payload, on_text=stream_callback)
+        
+        # Jangan cache hasil yang memicu tool call (efek samping harus dijalankan ulang)
+        if cache_key and response['success'] and not response.get('function_calls'):
+            self._response_cache[cache_key] = response
+            if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+        return response
+
+    def _response_cache_key(self):
+        """
+        Fingerprint semua input yang menentukan output: model, temperature, system instruction,
+        tools (bytes kanonik) dan history. Tidak tergantung nama handle cachedContents
+        """
+        digest = hashlib.blake2b(f"{self.model}\0{self.temperature}\0{self.system_instruction or ''}\0".encode('utf-8'), digest_size=16)
+        digest.update(self._tools_block_bytes)
+        digest.update(fastjson.dumps(self.history, sort_keys=True))
+        return digest.digest()
+
+    @staticmethod
+    def _estimate_tokens(contents):
+        """Estimasi kasar: ~4 byte JSON per token; media (inlineData base64) dihitung biaya tetap"""
+        total = 0
+        for content in contents:
+            for part in content.get('parts', []):
+                if 'inlineData' in part:
+                    total += MEDIA_PART_TOKENS
+                else:
+                    total += len(fastjson.dumps(part)) // 4
+        return total
+
+    def _estimate_history_tokens(self):
+        return self._estimate_tokens(self.history)
+
+    def _turn_starts(self):
+        """Index awal setiap turn (pesan user yang bukan functionResponse)"""
+        return [
+            i for i, content in enumerate(self.history)
+            if content.get('role') == 'user'
+            and not any('functionResponse' in part for part in content.get('parts', []))
+        ]
+
+    @staticmethod
+    def _history_to_transcript(contents):
+        """Ubah list content jadi transcript text untuk diringkas"""
+        lines = []
+        for content in contents:
+            role = content.get('role', 'user')
+            for part in content.get('parts', []):
+                if 'text' in part:
+                    lines.append(f"{role}: {part['text']}")
+                elif 'functionCall' in part:
+                    fc = part['functionCall']
+                    lines.append(f"{role}: [called tool {fc.get('name')}({fc.get('args')})]")
+                elif 'functionResponse' in part:
+                    fr = part['functionResponse']
+                    result = str(fr.get('response', {}).get('content', ''))[:500]
+                    lines.append(f"tool {fr.get('name')} result: {result}")
+                elif 'inlineData' in part:
+                    lines.append(f"{role}: [attached {part['inlineData'].get('mimeType', 'media')}]")
+        return "\n".join(lines)
+
+    def _compact_history(self):
+        """
+        Jaga ukuran history: kalau melebihi max_history_tokens, turn-turn lama diringkas
+        jadi satu pesan summary dan KEEP_RECENT_TURNS turn terakhir disimpan verbatim.
+        Pemotongan selalu di awal turn user, jadi pasangan functionCall/functionResponse tidak terpisah.
+        Summary dibuat di background; hasilnya dipasang oleh _apply_compaction di awal send_message berikutnya.
+        """
+        if self._pending_compaction or self._estimate_history_tokens() <= self.max_history_tokens:
+            return
+        
+        turn_starts = self._turn_starts()
+        if len(turn_starts) <= KEEP_RECENT_TURNS:
+            return
+        cut = turn_starts[-KEEP_RECENT_TURNS]
+        
+        # Kalau turn terbaru saja sudah lewat batas, meringkas prefix tidak membantu (dan membuang konteks)
+        if self._estimate_tokens(self.history[cut:]) > self.max_history_tokens:
+            return
+        
+        prefix = self.history[:cut]
+        transcript = self._history_to_transcript(prefix)
+        future = _TOOL_POOL.submit(
+            self.client.generate_content,
+            self.model,
+            f"Summarize the following conversation:\n\n{transcript}",
+            system_instruction=get_persona("summarizer")
+        )
+        self._pending_compaction = (future, prefix)
+
+    def _apply_compaction(self):
+        """Pasang summary dari _compact_history kalau sudah selesai (tidak menunggu kalau belum)"""
+        future, prefix = self._pending_compaction
+        if not future.done():
+            return
+        self._pending_compaction = None
+        
+        try:
+            response = future.result()
+        except Exception as e:
+            response = {'success': False, 'error': str(e)}
+        if not response.get('success') or not response.get('text'):
+            logger.warning(f"History summarization failed: {response.get('error')}")
+            return
+        
+        # History bisa berubah sejak summary diminta (reset/compaction lain): pasang hanya kalau prefix masih sama
+        cut = len(prefix)
+        if len(self.history) < cut or any(a is not b for a, b in zip(self.history[:cut], prefix)):
+            return
+        
+        logger.info(f"Compacted {cut} history entries into a summary")
+        self.history[:cut] = [
+            {"role": "user", "parts": [{"text": f"Summary of the earlier conversation:\n{response['text']}"}]},
+            {"role": "model", "parts": [{"text": "Understood. I will use this summary as context."}]},
+        ]
+
+    def _cap_tool_result(self, fc, result_str):
+        """Potong hasil tool yang terlalu besar (head + tail); hasil lengkap disimpan di tool_result_store"""
+        if len(result_str) <= MAX_TOOL_RESULT_CHARS:
+            return result_str
+        call_id = fc.get('id') or f"{fc['name']}-{secrets.token_hex(4)}"
+        self.tool_result_store[call_id] = result_str
+        elided = len(result_str) - TOOL_RESULT_HEAD_CHARS - TOOL_RESULT_TAIL_CHARS
+        return (
+            result_str[:TOOL_RESULT_HEAD_CHARS]
+            + f"\n... [elided {elided} chars] ...\n"
+            + result_str[-TOOL_RESULT_TAIL_CHARS:]
+        )
+
+    def _execute_tools(self, function_calls, stream_callback=None):
+        """
+        Eksekusi function calls, hasil (sudah jadi str) dikembalikan sesuai urutan call (model butuh urutan yang sama).
+        Kalau semua tool parallel-safe, dijalankan bersamaan di thread pool; kalau tidak
+        (tool stateful, MCP, atau butuh konfirmasi Safe Mode), dijalankan berurutan.
+        """
+        def report_running(fc):
+            if stream_callback:
+                stream_callback(f"\n[Running tool: {fc['name']}({fc['args']})]\n")
+
+        def report_result(result_str):
+            if stream_callback:
+                # Tampilkan preview hasil (dipotong biar gak kepanjangan)
+                preview = result_str[:200] + "..." if len(result_str) > 200 else result_str
+                stream_callback(f"[Result: {preview}]\n")
+
+        def as_str(tool_result):
+            return tool_result if isinstance(tool_result, str) else str(tool_result)
+
+        if len(function_calls) > 1 and all(self.tools.is_parallel_safe(fc['name']) for fc in function_calls):
+            for fc in function_calls:
+                report_running(fc)
+            results = list(_TOOL_POOL.map(lambda fc: as_str(self.tools.execute(fc['name'], fc['args'])), function_calls))
+            for tool_result in results:
+                report_result(tool_result)
+            return results
+        
+        # Semua call ke MCP server: kirim sebagai satu batch (satu write ke stdin server)
+        if len(function_calls) > 1 and all(self.tools.is_mcp_tool(fc['name']) for fc in function_calls):
+            for fc in function_calls:
+                report_running(fc)
+            results = [as_str(tool_result) for tool_result in self.tools.execute_mcp_batch(function_calls)]
+            for tool_result in results:
+                report_result(tool_result)
+            return results
+        
+        results = []
+        for fc in function_calls:
+            report_running(fc)
+            tool_result = as_str(self.tools.execute(fc['name'], fc['args']))
+            report_result(tool_result)
+            results.append(tool_result)
+        return results
 
     def send_message(self, message, media_items=None, stream_callback=None):
         """
@@ -55,6 +412,9 @@ class ChatSession:
         Returns:
             str: Jawaban final dari model.
         """
+        if self._pending_compaction:
+            self._apply_compaction()
+        
         # 1. Tambahkan pesan user ke history
         parts = [{"text": message}]
         if media_items:
@@ -80,16 +440,13 @@ class ChatSession:
             current_turn += 1
             
             # Kirim request ke API dengan history lengkap
-            response = self._generate_with_history()
+            # Text di-stream ke stream_callback per chunk SSE selama request berjalan
+            response = self._generate_with_history(stream_callback)
             
             if not response['success']:
                 return f"Error: {response.get('error')}"
             
-            # Handle Text Response (Streaming)
             text_response = response.get('text', '')
-            if text_response:
-                if stream_callback:
-                    stream_callback(text_response)
             
             # Handle Function Calls
             function_calls = response.get('function_calls')
@@ -102,6 +459,7 @@ class ChatSession:
                     "parts": [{"text": text_response}]
                 }
                 self.history.append(model_content)
+                self._compact_history()
                 return text_response
             
             # Jika ada function call, eksekusi tool
@@ -130,29 +488,19 @@ class ChatSession:
             })
             
             # Eksekusi setiap tool dan kumpulkan hasilnya
+            tool_results = self._execute_tools(function_calls, stream_callback)
+            
             fr_parts = []
-            for fc in function_calls:
+            for fc, tool_result in zip(function_calls, tool_results):
                 tool_name = fc['name']
-                args = fc['args']
-                
-                if stream_callback:
-                    stream_callback(f"\n[Running tool: {tool_name}({args})]\n")
-                
-                # Execute
-                tool_result = self.tools.execute(tool_name, args)
                 
                 # Format Function Response
                 fr_parts.append({
                     "functionResponse": {
                         "name": tool_name,
-                        "response": {"name": tool_name, "content": str(tool_result)}
+                        "response": {"name": tool_name, "content": self._cap_tool_result(fc, tool_result)}
                     }
                 })
-                
-                if stream_callback:
-                    # Tampilkan preview hasil (dipotong biar gak kepanjangan)
-                    preview = str(tool_result)[:200] + "..." if len(str(tool_result)) > 200 else str(tool_result)
-                    stream_callback(f"[Result: {preview}]\n")
 
             # Tambahkan hasil tool ke history sebagai 'function' role (atau user role dengan functionResponse)
             # Di API Code Assist, biasanya functionResponse dikirim sebagai bagian dari conversation
@@ -165,4 +513,16 @@ class ChatSession:
             
         return "Error: Max tool execution turns reached."
 
-
+    async def send_message_async(self, message, media_items=None, stream_callback=None):
+        """
+        Versi async dari send_message untuk dipakai di event loop asyncio.
+        Request HTTP & tool loop tetap jalan di thread worker (Session keep-alive + tool pool
+        paralel sudah dipakai), jadi event loop pemanggil tidak ter-block.
+        Catatan: stream_callback dipanggil dari thread worker.
+        """
+        import asyncio # Lazy: asyncio (dan subprocess yang ikut ter-import) cukup berat untuk startup CLI
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(self.send_message, message, media_items=media_items, stream_callback=stream_callback)
+        )
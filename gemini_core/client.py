@@ -1,13 +1,47 @@
 import os
-import json
 import time
+import hashlib
 import logging
-import requests
-from .config import CODE_ASSIST_ENDPOINT, CODE_ASSIST_API_VERSION
-from .auth import GoogleAuth
+import secrets
+from . import fastjson
+from .config import CODE_ASSIST_ENDPOINT, CODE_ASSIST_API_VERSION, URL_LOAD, URL_ONBOARD, URL_GENERATE_STREAM
+from .config import SESSION_CACHE_FILE, SESSION_CACHE_TTL_SECONDS
 
 logger = logging.getLogger(__name__)
 
+_CODE_ASSIST_URLS = {
+    'loadCodeAssist': URL_LOAD,
+    'onboardUser': URL_ONBOARD,
+}
+
+def _iter_sse_data(response):
+    """
+    Parse stream SSE langsung di level bytes: potong per baris dengan bytearray.find,
+    dan hanya payload setelah 'data: ' yang di-parse sebagai JSON.
+    """
+    buf = bytearray()
+    for chunk in response.iter_content(chunk_size=None): # Yield begitu data tiba
+        buf += chunk
+        start = 0
+        while True:
+            nl = buf.find(b'\n', start)
+            if nl == -1:
+                break
+            if buf.startswith(b'data: ', start, nl):
+                try:
+                    yield fastjson.loads(buf[start + 6:nl]) # '\r' sisa CRLF dianggap whitespace
+                except fastjson.JSONDecodeError:
+                    pass
+            start = nl + 1
+        del buf[:start]
+    
+    # Baris terakhir tanpa newline
+    if buf.startswith(b'data: '):
+        try:
+            yield fastjson.loads(buf[6:])
+        except fastjson.JSONDecodeError:
+            pass
+
 class GeminiClient:
     def __init__(self, credentials_file, auth_mode='oauth', api_key=None, vertex_project=None, vertex_location='us-central1'):
         self.auth_mode = auth_mode
@@ -20,33 +54,64 @@ class GeminiClient:
         
         # OAuth & Vertex butuh GoogleAuth
         if self.auth_mode in ['oauth', 'vertex']:
+            from .auth import GoogleAuth # Lazy: google-auth cukup berat untuk di-import
             self.auth = GoogleAuth(credentials_file)
             self.creds = self.auth.authenticate() 
             
         self.project_id = None
         self.user_tier = None
         self.session_setup = False
+        self.session_cache_file = os.path.join(os.path.dirname(credentials_file or ''), SESSION_CACHE_FILE)
+        
+        # Satu Session untuk semua request: koneksi TCP/TLS di-reuse antar turn (keep-alive)
+        # requests di-import di sini (bukan di top-level) supaya startup CLI tidak menunggu import-nya
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        
+        self._apikey_headers = {'Content-Type': 'application/json'}
+        self._header_cache = (None, None) # (token, headers)
+        
+        # Template URL generate per mode; tinggal diisi nama model tiap request
+        if self.auth_mode == 'apikey':
+            self._generate_url = f"https://generativelanguage.googleapis.com/v1beta/models/{{model}}:streamGenerateContent?key={self.api_key}&alt=sse"
+        elif self.auth_mode == 'vertex':
+            self._generate_url = (
+                f"https://{self.vertex_location}-aiplatform.googleapis.com/v1/projects/{self.vertex_project}"
+                f"/locations/{self.vertex_location}/publishers/google/models/{{model}}:streamGenerateContent?alt=sse"
+            )
+        else:
+            self._generate_url = URL_GENERATE_STREAM
+
+    def close(self):
+        """Tutup connection pool HTTP"""
+        self.session.close()
 
     def _get_headers(self):
+        """Header di-cache, hanya dibangun ulang kalau token berubah (refresh)"""
         if self.auth_mode == 'apikey':
-            return {'Content-Type': 'application/json'}
+            return self._apikey_headers
             
-        return {
-            'Authorization': f'Bearer {self.creds.token}',
-            'Content-Type': 'application/json',
-        }
+        token = self.creds.token
+        if self._header_cache[1] is None or self._header_cache[0] is not token:
+            self._header_cache = (token, {
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json',
+            })
+        return self._header_cache[1]
 
     def _request(self, method, payload=None, stream=False):
         """Helper untuk melakukan request ke Code Assist Server"""
-        url = f"{CODE_ASSIST_ENDPOINT}/{CODE_ASSIST_API_VERSION}:{method}"
+        url = _CODE_ASSIST_URLS.get(method) or f"{CODE_ASSIST_ENDPOINT}/{CODE_ASSIST_API_VERSION}:{method}"
         if stream:
             url += "?alt=sse"
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 url, 
                 headers=self._get_headers(), 
-                json=payload or {},
+                data=fastjson.dumps(payload or {}),
                 stream=stream
             )
             return response
@@ -67,10 +132,16 @@ class GeminiClient:
             self.session_setup = True
             return
 
+        env_project = os.getenv('GOOGLE_CLOUD_PROJECT') or os.getenv('GOOGLE_CLOUD_PROJECT_ID')
+        
+        # 0. Pakai hasil onboarding dari run sebelumnya kalau masih segar
+        if self._load_session_cache(env_project):
+            logger.info(f"Using cached session. Project: {self.project_id}, Tier: {self.user_tier}")
+            return
+
         logger.info("Setting up user session (Onboarding)...")
         
         # 1. Cek status user saat ini
-        env_project = os.getenv('GOOGLE_CLOUD_PROJECT') or os.getenv('GOOGLE_CLOUD_PROJECT_ID')
         
         load_payload = {
             'cloudaicompanionProject': env_project,
@@ -93,6 +164,7 @@ class GeminiClient:
             self.user_tier = load_data['currentTier'].get('id')
             self.project_id = load_data.get('cloudaicompanionProject', env_project)
             self.session_setup = True
+            self._save_session_cache(env_project)
             logger.info(f"User already setup. Project: {self.project_id}, Tier: {self.user_tier}")
             return
 
@@ -125,13 +197,14 @@ class GeminiClient:
             raise Exception("Gagal start onboarding")
             
         lro_data = lro_res.json()
-        max_polls = 10
+        max_polls = 15 # Backoff 0.2s -> 3s: total tunggu ~30s seperti sebelumnya
         poll_count = 0
         
         while not lro_data.get('done') and poll_count < max_polls:
+            # Exponential backoff: onboarding biasanya selesai dalam 1-2 poll
+            time.sleep(min(3.0, 0.2 * (1.5 ** poll_count)))
             poll_count += 1
             logger.info(f"Polling onboarding status ({poll_count}/{max_polls})...")
-            time.sleep(3)
             lro_res = self._request('onboardUser', onboard_payload)
             if lro_res:
                 lro_data = lro_res.json()
@@ -149,10 +222,118 @@ class GeminiClient:
             
         self.user_tier = tier_id
         self.session_setup = True
+        self._save_session_cache(env_project)
         logger.info(f"Onboarding sukses! Project: {self.project_id}, Tier: {self.user_tier}")
 
-    def _request_generate(self, payload):
-        """Internal method untuk kirim request generate dan parse response"""
+    def _account_id(self):
+        """Identitas akun yang login (hash, token asli tidak ikut ditulis ke cache)"""
+        creds = self.auth.creds or self.creds
+        identity = f"{getattr(creds, 'client_id', '')}:{getattr(creds, 'refresh_token', '')}"
+        return hashlib.blake2b(identity.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _load_session_cache(self, env_project):
+        """Muat project_id/user_tier dari cache session. Return True kalau valid (belum expired)"""
+        try:
+            with open(self.session_cache_file, 'rb') as f:
+                data = fastjson.loads(f.read())
+        except (OSError, fastjson.JSONDecodeError):
+            return False
+        if not isinstance(data, dict):
+            return False
+        
+        # Cache tidak berlaku kalau akun/GOOGLE_CLOUD_PROJECT berubah atau sudah lewat TTL
+        if (data.get('account') != self._account_id() or data.get('env_project') != env_project
+                or time.time() - data.get('cached_at', 0) > SESSION_CACHE_TTL_SECONDS):
+            return False
+        self.project_id = data.get('project_id')
+        self.user_tier = data.get('user_tier')
+        self.session_setup = True
+        return True
+
+    def _save_session_cache(self, env_project):
+        """Simpan hasil onboarding (atomic: tulis file sementara lalu os.replace)"""
+        data = {
+            'account': self._account_id(),
+            'project_id': self.project_id,
+            'user_tier': self.user_tier,
+            'env_project': env_project,
+            'cached_at': time.time(),
+        }
+        try:
+            tmp = self.session_cache_file + ".tmp"
+            with open(tmp, 'wb') as f:
+                f.write(fastjson.dumps(data))
+            os.replace(tmp, self.session_cache_file)
+        except OSError as e:
+            logger.warning(f"Gagal menyimpan session cache: {e}")
+
+    def clear_session_cache(self):
+        """Hapus cache onboarding (dipanggil saat ganti akun/login ulang)"""
+        try:
+            os.remove(self.session_cache_file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Gagal menghapus session cache: {e}")
+
+    def create_cached_content(self, model, system_instruction=None, tools=None, ttl_seconds=3600):
+        """
+        Buat handle cachedContents untuk prefix statis (system instruction + tools),
+        supaya prefix itu tidak dikirim & di-prefill ulang setiap turn.
+        Return nama handle (misal 'cachedContents/abc') atau None jika tidak didukung/gagal.
+        """
+        if self.auth_mode == 'apikey':
+            if not self.api_key:
+                return None
+            url = f"https://generativelanguage.googleapis.com/v1beta/cachedContents?key={self.api_key}"
+            model_name = f"models/{model}"
+        elif self.auth_mode == 'vertex':
+            if not self.vertex_project:
+                return None
+            base = f"projects/{self.vertex_project}/locations/{self.vertex_location}"
+            url = f"https://{self.vertex_location}-aiplatform.googleapis.com/v1/{base}/cachedContents"
+            model_name = f"{base}/publishers/google/models/{model}"
+        else:
+            # Code Assist API (oauth) tidak punya endpoint cachedContents
+            return None
+        
+        body = {"model": model_name, "ttl": f"{ttl_seconds}s"}
+        if system_instruction:
+            body["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        if tools:
+            body["tools"] = [tools]
+        
+        try:
+            res = self.session.post(url, headers=self._get_headers(), data=fastjson.dumps(body))
+            if res.status_code != 200:
+                # Misal prefix terlalu pendek (di bawah minimum token cache)
+                logger.info(f"cachedContents not available ({res.status_code}), sending full prefix")
+                return None
+            return res.json().get('name')
+        except Exception as e:
+            logger.warning(f"Failed to create cachedContents: {e}")
+            return None
+
+    def delete_cached_content(self, name):
+        """Hapus handle cachedContents yang tidak dipakai lagi (supaya tidak ditagih sampai TTL habis)"""
+        if self.auth_mode == 'apikey':
+            url = f"https://generativelanguage.googleapis.com/v1beta/{name}?key={self.api_key}"
+        elif self.auth_mode == 'vertex':
+            url = f"https://{self.vertex_location}-aiplatform.googleapis.com/v1/{name}"
+        else:
+            return False
+        try:
+            res = self.session.delete(url, headers=self._get_headers())
+            return res.status_code == 200
+        except Exception as e:
+            logger.warning(f"Failed to delete cachedContents: {e}")
+            return False
+
+    def _stream_generate(self, payload):
+        """
+        Generator: kirim request generate dan yield event per SSE chunk begitu diterima.
+        Event: {'text': str} / {'function_call': dict} / {'thought_signature': str} / {'error': str}
+        """
         logger.info(f"Sending request to {payload['model']}...")
         
         # DEBUG: Print Payload Content Structure
@@ -162,80 +343,94 @@ class GeminiClient:
         # Determine URL & Payload based on Mode
         if self.auth_mode == 'apikey':
             if not self.api_key:
-                return {'success': False, 'error': "API Key is missing!"}
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{payload['model']}:streamGenerateContent?key={self.api_key}&alt=sse"
+                yield {'error': "API Key is missing!"}
+                return
+            url = self._generate_url.format(model=payload['model'])
             json_payload = payload['request'] # Direct payload
             
         elif self.auth_mode == 'vertex':
             if not self.vertex_project:
-                return {'success': False, 'error': "Vertex Project ID is missing!"}
-            url = f"https://{self.vertex_location}-aiplatform.googleapis.com/v1/projects/{self.vertex_project}/locations/{self.vertex_location}/publishers/google/models/{payload['model']}:streamGenerateContent?alt=sse"
+                yield {'error': "Vertex Project ID is missing!"}
+                return
+            url = self._generate_url.format(model=payload['model'])
             json_payload = payload['request'] # Direct payload
             
         else: # oauth (Internal API)
-            url = f"{CODE_ASSIST_ENDPOINT}/{CODE_ASSIST_API_VERSION}:streamGenerateContent?alt=sse"
+            url = self._generate_url
             json_payload = payload # Wrapped payload
             
         headers = self._get_headers()
         
         try:
-            response = requests.post(url, headers=headers, json=json_payload, stream=True)
-            
-            # DEBUG: Cek status code
-            if response.status_code != 200:
-                try:
-                    error_data = response.json()
-                    error_msg = error_data.get('error', {}).get('message', response.text)
-                    if response.status_code == 429:
-                        return {'success': False, 'error': f"⏳ RATE LIMIT: {error_msg}"}
-                    return {'success': False, 'error': f"API Error {response.status_code}: {error_msg}"}
-                except:
-                    return {'success': False, 'error': f"HTTP {response.status_code}"}
+            # Serialisasi compact & deterministik: prefix history byte-identik antar turn,
+            # jadi prefix caching di server bisa hit
+            body = fastjson.dumps(json_payload)
+            with self.session.post(url, headers=headers, data=body, stream=True) as response:
                 
-            final_text = []
-            function_calls = []
-            thought_signature = None
-            
-            for line in response.iter_lines():
-                if line:
-                    decoded_line = line.decode('utf-8')
-                    if decoded_line.startswith('data: '):
-                        try:
-                            json_str = decoded_line[6:] # Skip 'data: '
-                            data = json.loads(json_str)
-                            
-                            # ... (error handling & wrapper logic sama) ...
-                            if 'error' in data:
-                                return {'success': False, 'error': data['error']['message']}
-                            
-                            actual_data = data.get('response', data)
-                            
-                            if 'candidates' in actual_data and len(actual_data['candidates']) > 0:
-                                candidate = actual_data['candidates'][0]
-                                if 'content' in candidate and 'parts' in candidate['content']:
-                                    for part in candidate['content']['parts']:
-                                        if 'text' in part:
-                                            final_text.append(part['text'])
-                                        if 'functionCall' in part:
-                                            function_calls.append(part['functionCall'])
-                                        if 'thoughtSignature' in part:
-                                            thought_signature = part['thoughtSignature']
-                                            
-                        except json.JSONDecodeError:
-                            pass
-                            
-            if not final_text and not function_calls:
-                 return {'success': False, 'error': "Unknown error (Empty response)"}
-
-            return {
-                'success': True,
-                'text': "".join(final_text),
-                'function_calls': function_calls,
-                'thought_signature': thought_signature
-            }
+                # DEBUG: Cek status code
+                if response.status_code != 200:
+                    try:
+                        error_data = response.json()
+                        error_msg = error_data.get('error', {}).get('message', response.text)
+                        if response.status_code == 429:
+                            yield {'error': f"⏳ RATE LIMIT: {error_msg}"}
+                        else:
+                            yield {'error': f"API Error {response.status_code}: {error_msg}"}
+                    except:
+                        yield {'error': f"HTTP {response.status_code}"}
+                    return
+                
+                for data in _iter_sse_data(response):
+                    if 'error' in data:
+                        yield {'error': data['error']['message']}
+                        return
+                    
+                    actual_data = data.get('response', data)
+                    
+                    if 'candidates' in actual_data and len(actual_data['candidates']) > 0:
+                        candidate = actual_data['candidates'][0]
+                        if 'content' in candidate and 'parts' in candidate['content']:
+                            for part in candidate['content']['parts']:
+                                if 'text' in part:
+                                    yield {'text': part['text']}
+                                if 'functionCall' in part:
+                                    yield {'function_call': part['functionCall']}
+                                if 'thoughtSignature' in part:
+                                    yield {'thought_signature': part['thoughtSignature']}
             
         except Exception as e:
-            return {'success': False, 'error': str(e)}
+            yield {'error': str(e)}
+
+    def _request_generate(self, payload, on_text=None):
+        """
+        Kirim request generate dan kumpulkan hasil stream jadi satu response dict.
+        on_text (func): dipanggil untuk setiap potongan text begitu tiba (opsional).
+        """
+        final_text = []
+        function_calls = []
+        thought_signature = None
+        
+        for event in self._stream_generate(payload):
+            if 'error' in event:
+                return {'success': False, 'error': event['error']}
+            if 'text' in event:
+                final_text.append(event['text'])
+                if on_text:
+                    on_text(event['text'])
+            elif 'function_call' in event:
+                function_calls.append(event['function_call'])
+            elif 'thought_signature' in event:
+                thought_signature = event['thought_signature']
+                
+        if not final_text and not function_calls:
+             return {'success': False, 'error': "Unknown error (Empty response)"}
+
+        return {
+            'success': True,
+            'text': "".join(final_text),
+            'function_calls': function_calls,
+            'thought_signature': thought_signature
+        }
 
     def generate_content(self, model, prompt, tools=None, system_instruction=None, media_items=None):
         """
@@ -284,7 +479,7 @@ class GeminiClient:
         payload = {
             "model": model,
             "project": self.project_id,
-            "user_prompt_id": f"python-client-{int(time.time() * 1000)}",
+            "user_prompt_id": f"python-client-{secrets.token_hex(8)}",
             "request": request_payload
         }
         
@@ -6,6 +6,11 @@ Konfigurasi untuk Gemini Bypass Library
 CODE_ASSIST_ENDPOINT = 'https://cloudcode-pa.googleapis.com'
 CODE_ASSIST_API_VERSION = 'v1internal'
 
+# URL lengkap per method (dibangun sekali saat import)
+URL_LOAD = f"{CODE_ASSIST_ENDPOINT}/{CODE_ASSIST_API_VERSION}:loadCodeAssist"
+URL_ONBOARD = f"{CODE_ASSIST_ENDPOINT}/{CODE_ASSIST_API_VERSION}:onboardUser"
+URL_GENERATE_STREAM = f"{CODE_ASSIST_ENDPOINT}/{CODE_ASSIST_API_VERSION}:streamGenerateContent?alt=sse"
+
 import os
 
 # --- OAUTH CONFIGURATION (Sama seperti gemini-cli) ---
@@ -28,6 +33,10 @@ SIGN_IN_FAILURE_URL = 'https://developers.google.com/gemini-code-assist/auth_fai
 # Default credentials file
 DEFAULT_CREDENTIALS_FILE = 'gemini_cli_creds.json'
 
+# Cache hasil onboarding (project_id & tier), disimpan di sebelah credentials file
+SESSION_CACHE_FILE = 'gemini_cli_session.json'
+SESSION_CACHE_TTL_SECONDS = 24 * 3600
+
 # Safety Settings
 SAFE_MODE = True  # Jika True, tool berbahaya (terminal, write) butuh konfirmasi user
 
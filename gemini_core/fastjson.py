@@ -0,0 +1,23 @@
+"""
+JSON helper: pakai orjson (C extension, jauh lebih cepat) kalau ter-install,
+fallback ke stdlib json. dumps() selalu menghasilkan bytes UTF-8 yang compact.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson:
+    JSONDecodeError = orjson.JSONDecodeError
+    loads = orjson.loads
+
+    def dumps(obj, sort_keys=False):
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+else:
+    JSONDecodeError = json.JSONDecodeError
+    loads = json.loads
+
+    def dumps(obj, sort_keys=False):
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, sort_keys=sort_keys).encode('utf-8')
@@ -1,12 +1,15 @@
 import os
-import json
 import logging
-import subprocess
+import itertools
 import threading
-import queue
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from . import fastjson
 
 logger = logging.getLogger(__name__)
 
+MCP_REQUEST_TIMEOUT = 10 # detik
+
 class MCPClient:
     def __init__(self, command, args=None):
         """
@@ -15,33 +18,36 @@ class MCPClient:
         self.command = command
         self.args = args or []
         self.process = None
-        self.request_id = 0
-        self.pending_requests = {}
+        self._ids = itertools.count(1) # next() atomic, aman dipanggil dari banyak thread
+        self._write_lock = threading.Lock()
+        self.pending_requests = {} # req_id -> Future, di-resolve oleh _read_loop
         self.tools = []
+        self.tools_version = 0 # Naik setiap daftar tools berubah (untuk invalidasi cache definisi)
+        self._defs_cache = (None, None) # (tools_version, definitions)
         self.is_connected = False
-        
-        # Queue untuk membaca output
-        self.response_queue = queue.Queue()
 
     def connect(self):
         """Jalankan server dan handshake"""
+        import subprocess # Lazy: tidak perlu di-load kalau tidak ada MCP server
         try:
             full_cmd = [self.command] + self.args
             logger.info(f"Starting MCP Server: {full_cmd}")
             
             # Start subprocess dengan pipe untuk stdin/stdout
+            # Binary mode: frame JSON ditulis/dibaca sebagai bytes (tanpa encode/decode text layer)
+            # stderr server hanya dibaca kalau logging DEBUG aktif, selain itu dibuang oleh OS
+            log_stderr = logger.isEnabledFor(logging.DEBUG)
             self.process = subprocess.Popen(
                 full_cmd,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1 # Line buffered
+                stderr=subprocess.PIPE if log_stderr else subprocess.DEVNULL
             )
             
             # Start thread untuk baca stdout
             threading.Thread(target=self._read_loop, daemon=True).start()
-            threading.Thread(target=self._error_loop, daemon=True).start()
+            if log_stderr:
+                threading.Thread(target=self._error_loop, daemon=True).start()
             
             # Initialize (Handshake)
             init_result = self.send_request("initialize", {
@@ -56,12 +62,17 @@ class MCPClient:
             })
             
             if init_result:
-                self.send_notification("notifications/initialized")
+                # 'initialized' + 'tools/list' dikirim dalam satu write (satu round trip ke server)
+                submitted = self._submit(
+                    "tools/list",
+                    notifications=[self._notification("notifications/initialized")]
+                )
                 self.is_connected = True
                 logger.info("MCP Server initialized successfully!")
                 
                 # Discover Tools
-                self._refresh_tools()
+                if submitted:
+                    self._set_tools(self._wait_response(*submitted, "tools/list"))
                 return True
                 
         except Exception as e:
@@ -75,86 +86,120 @@ class MCPClient:
             line = self.process.stdout.readline()
             if line:
                 try:
-                    message = json.loads(line)
-                    if "id" in message and message["id"] in self.pending_requests:
+                    message = fastjson.loads(line)
+                except fastjson.JSONDecodeError:
+                    continue
+                # Server boleh membalas batch dengan satu JSON array
+                for item in (message if isinstance(message, list) else (message,)):
+                    future = self.pending_requests.get(item.get("id"))
+                    if future:
                         # Response untuk request kita
-                        self.pending_requests[message["id"]].put(message)
+                        future.set_result(item)
                     else:
                         # Notification atau request dari server (belum dihandle)
                         pass
-                except json.JSONDecodeError:
-                    pass
 
     def _error_loop(self):
-        """Loop membaca stderr (log) dari server"""
-        while self.process and self.process.poll() is None:
-            line = self.process.stderr.readline()
-            if line:
-                # logger.debug(f"MCP STDERR: {line.strip()}")
-                pass
+        """Teruskan stderr (log) dari server ke logger (hanya jalan di mode DEBUG)"""
+        for line in iter(self.process.stderr.readline, b''):
+            logger.debug(f"MCP STDERR: {line.rstrip().decode('utf-8', 'replace')}")
 
-    def send_request(self, method, params=None):
-        """Kirim JSON-RPC Request"""
-        self.request_id += 1
-        req_id = self.request_id
-        
-        request = {
+    def _write(self, *messages):
+        """Tulis satu atau lebih frame JSON-RPC ke stdin server dalam satu write + flush"""
+        data = b"".join(fastjson.dumps(message) + b"\n" for message in messages)
+        with self._write_lock:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+
+    @staticmethod
+    def _notification(method, params=None):
+        return {
             "jsonrpc": "2.0",
-            "id": req_id,
             "method": method,
             "params": params or {}
         }
-        
-        # Siapkan queue untuk response
-        resp_queue = queue.Queue()
-        self.pending_requests[req_id] = resp_queue
+
+    def _submit_many(self, calls, notifications=()):
+        """
+        Tulis beberapa JSON-RPC Request (list of (method, params)) dalam satu write, tanpa menunggu.
+        Return list (req_id, Future) sesuai urutan calls, atau None jika gagal kirim.
+        notifications: notification yang ditulis tepat sebelum request, dalam write yang sama.
+        """
+        requests = []
+        submitted = []
+        for method, params in calls:
+            req_id = next(self._ids)
+            requests.append({
+                "jsonrpc": "2.0",
+                "id": req_id,
+                "method": method,
+                "params": params or {}
+            })
+            # Siapkan Future untuk response (di-resolve langsung oleh reader thread)
+            future = Future()
+            self.pending_requests[req_id] = future
+            submitted.append((req_id, future))
         
         # Kirim
         try:
-            json_str = json.dumps(request)
-            self.process.stdin.write(json_str + "\n")
-            self.process.stdin.flush()
+            self._write(*notifications, *requests)
         except Exception as e:
+            for req_id, _ in submitted:
+                self.pending_requests.pop(req_id, None)
             logger.error(f"Failed to send request: {e}")
             return None
-            
-        # Tunggu response (timeout 10s)
+        return submitted
+
+    def _submit(self, method, params=None, notifications=()):
+        """Tulis satu JSON-RPC Request tanpa menunggu. Return (req_id, Future) atau None jika gagal kirim"""
+        submitted = self._submit_many([(method, params)], notifications)
+        return submitted[0] if submitted else None
+
+    def _wait_response(self, req_id, future, method):
+        """Tunggu response untuk request yang sudah di-_submit"""
         try:
-            response = resp_queue.get(timeout=10)
-            del self.pending_requests[req_id]
-            
-            if "error" in response:
-                logger.error(f"MCP Error: {response['error']}")
-                return None
-                
-            return response.get("result")
-        except queue.Empty:
+            response = future.result(timeout=MCP_REQUEST_TIMEOUT)
+        except FutureTimeoutError:
             logger.error(f"MCP Request timeout: {method}")
             return None
+        finally:
+            self.pending_requests.pop(req_id, None)
+        
+        if "error" in response:
+            logger.error(f"MCP Error: {response['error']}")
+            return None
+            
+        return response.get("result")
+
+    def send_request(self, method, params=None):
+        """Kirim JSON-RPC Request dan tunggu hasilnya (timeout 10s)"""
+        submitted = self._submit(method, params)
+        if not submitted:
+            return None
+        return self._wait_response(*submitted, method)
 
     def send_notification(self, method, params=None):
         """Kirim JSON-RPC Notification (tanpa response)"""
-        notification = {
-            "jsonrpc": "2.0",
-            "method": method,
-            "params": params or {}
-        }
         try:
-            json_str = json.dumps(notification)
-            self.process.stdin.write(json_str + "\n")
-            self.process.stdin.flush()
+            self._write(self._notification(method, params))
         except:
             pass
 
     def _refresh_tools(self):
         """Ambil daftar tools dari server"""
-        result = self.send_request("tools/list")
+        self._set_tools(self.send_request("tools/list"))
+
+    def _set_tools(self, result):
+        """Simpan hasil 'tools/list'"""
         if result and "tools" in result:
             self.tools = result["tools"]
+            self.tools_version += 1
             logger.info(f"Discovered {len(self.tools)} tools from MCP Server")
 
     def get_tool_definitions(self):
-        """Konversi MCP tools ke format Gemini API"""
+        """Konversi MCP tools ke format Gemini API (di-cache sampai daftar tools berubah)"""
+        if self._defs_cache[0] == self.tools_version:
+            return self._defs_cache[1]
         definitions = []
         for tool in self.tools:
             definitions.append({
@@ -162,6 +207,7 @@ class MCPClient:
                 "description": tool.get("description", ""),
                 "parameters": tool.get("inputSchema", {})
             })
+        self._defs_cache = (self.tools_version, definitions)
         return definitions
 
     def call_tool(self, name, arguments):
@@ -171,6 +217,20 @@ class MCPClient:
             "arguments": arguments
         })
 
+    def call_tools_batch(self, calls):
+        """
+        Panggil beberapa tool sekaligus: list of (name, arguments).
+        Semua request ditulis dalam satu write lalu ditunggu bersama; hasil sesuai urutan calls.
+        """
+        submitted = self._submit_many([
+            ("tools/call", {"name": name, "arguments": arguments})
+            for name, arguments in calls
+        ])
+        if not submitted:
+            return [None] * len(calls)
+        return [self._wait_response(req_id, future, "tools/call") for req_id, future in submitted]
+
     def close(self):
+        self.is_connected = False
         if self.process:
             self.process.terminate()
@@ -1,6 +1,8 @@
 """
 Kumpulan System Instructions (Personas) untuk Gemini.
 """
+import textwrap
+from types import MappingProxyType
 
 PERSONAS = {
     "default": """
@@ -39,8 +41,18 @@ You are a strict Code Reviewer.
 - Be critical but constructive.
 - Suggest refactoring where appropriate.
 - Rate the code quality from 1 to 10 at the end.
+""",
+
+    "summarizer": """
+You summarize conversations between a user and an AI assistant.
+- Preserve facts, decisions, file names, code identifiers, and open tasks.
+- Mention tool calls only when their results matter for later questions.
+- Write a compact bullet list. Do not add commentary.
 """
 }
 
+# Normalisasi sekali saat import (teks ini ikut terkirim tiap turn), lalu dibuat read-only
+PERSONAS = MappingProxyType({name: textwrap.dedent(text).strip() for name, text in PERSONAS.items()})
+
 def get_persona(name):
     return PERSONAS.get(name, PERSONAS["default"])
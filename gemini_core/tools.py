@@ -1,27 +1,114 @@
 import os
-import json
+import itertools
 import logging
-import subprocess
-import glob
+import mmap
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from . import config
 
 logger = logging.getLogger(__name__)
 
+# Tool local yang butuh konfirmasi user di Safe Mode
+SENSITIVE_TOOLS = frozenset({'run_terminal', 'write_file'})
+
+# Schema parameter manual untuk local tools (dibangun sekali, dipakai ulang tiap turn)
+_PARAM_SCHEMAS = {
+    "read_file": {
+        "type": "OBJECT",
+        "properties": {
+            "filepath": {"type": "STRING", "description": "Path absolut atau relatif ke file yang akan dibaca"}
+        },
+        "required": ["filepath"]
+    },
+    "write_file": {
+        "type": "OBJECT",
+        "properties": {
+            "filepath": {"type": "STRING", "description": "Path absolut atau relatif untuk file baru"},
+            "content": {"type": "STRING", "description": "Isi text yang akan ditulis ke file"}
+        },
+        "required": ["filepath", "content"]
+    },
+    "list_directory": {
+        "type": "OBJECT",
+        "properties": {
+            "path": {"type": "STRING", "description": "Path directory yang akan di-list (default: current directory)"}
+        },
+        "required": []
+    },
+    "run_terminal": {
+        "type": "OBJECT",
+        "properties": {
+            "command": {"type": "STRING", "description": "Command terminal yang akan dijalankan (misal: 'pip install requests', 'git status')"}
+        },
+        "required": ["command"]
+    },
+    "search_files": {
+        "type": "OBJECT",
+        "properties": {
+            "pattern": {"type": "STRING", "description": "Glob pattern untuk file (misal: '**/*.py')"},
+            "query": {"type": "STRING", "description": "Text yang dicari di dalam file"}
+        },
+        "required": ["pattern", "query"]
+    },
+    "web_search": {
+        "type": "OBJECT",
+        "properties": {
+            "query": {"type": "STRING", "description": "Kata kunci pencarian"}
+        },
+        "required": ["query"]
+    }
+}
+_EMPTY_SCHEMA = {"type": "OBJECT", "properties": {}}
+
 class ToolRegistry:
     def __init__(self):
         self.tools = {}
+        self.parallel_safe = set() # Tool tanpa efek samping, boleh dijalankan paralel
         self.mcp_clients = [] # List of connected MCP clients
+        
+        # Cache hasil get_tool_definitions; _defs_version naik setiap register/register_mcp
+        self._defs_version = 0
+        self._defs_sig = None
+        self._defs_cache = None
+        
+        # Index nama tool MCP -> client, dibangun ulang kalau status/daftar tools MCP berubah
+        self._mcp_index = {}
+        self._mcp_index_sig = None
 
     def register_mcp(self, mcp_client):
         """Register MCP Client"""
         self.mcp_clients.append(mcp_client)
+        self._defs_version += 1
+
+    def register(self, func=None, *, parallel_safe=False):
+        """
+        Decorator untuk mendaftarkan tool local.
+        Pakai @registry.register(parallel_safe=True) untuk tool read-only/stateless.
+        """
+        def decorator(f):
+            self.tools[f.__name__] = f
+            self._defs_version += 1
+            if parallel_safe:
+                self.parallel_safe.add(f.__name__)
+            return f
+        return decorator(func) if func else decorator
 
-    def register(self, func):
-        """Decorator untuk mendaftarkan tool local"""
-        self.tools[func.__name__] = func
-        return func
+    def is_parallel_safe(self, tool_name):
+        """True jika tool boleh dieksekusi bersamaan dengan tool lain (MCP tools dianggap tidak)"""
+        return tool_name in self.parallel_safe
 
     def get_tool_definitions(self):
-        """Mengembalikan definisi tools (Local + MCP)"""
+        """
+        Mengembalikan definisi tools (Local + MCP).
+        Object yang sama dikembalikan selama registry & status/daftar tools MCP tidak berubah.
+        """
+        sig = (self._defs_version, tuple((c.is_connected, c.tools_version) for c in self.mcp_clients))
+        if sig == self._defs_sig:
+            return self._defs_cache
+        
         definitions = []
         
         # 1. Local Tools
@@ -38,76 +125,56 @@ class ToolRegistry:
         for client in self.mcp_clients:
             if client.is_connected:
                 definitions.extend(client.get_tool_definitions())
-                
-        return {"function_declarations": definitions}
+        
+        self._defs_sig = sig
+        self._defs_cache = {"function_declarations": definitions}
+        return self._defs_cache
 
     def _get_params_schema(self, func_name):
         """Schema parameter manual"""
-        if func_name == "read_file":
-            return {
-                "type": "OBJECT",
-                "properties": {
-                    "filepath": {"type": "STRING", "description": "Path absolut atau relatif ke file yang akan dibaca"}
-                },
-                "required": ["filepath"]
-            }
-        elif func_name == "write_file":
-            return {
-                "type": "OBJECT",
-                "properties": {
-                    "filepath": {"type": "STRING", "description": "Path absolut atau relatif untuk file baru"},
-                    "content": {"type": "STRING", "description": "Isi text yang akan ditulis ke file"}
-                },
-                "required": ["filepath", "content"]
-            }
-        elif func_name == "list_directory":
-            return {
-                "type": "OBJECT",
-                "properties": {
-                    "path": {"type": "STRING", "description": "Path directory yang akan di-list (default: current directory)"}
-                },
-                "required": []
-            }
-        elif func_name == "run_terminal":
-            return {
-                "type": "OBJECT",
-                "properties": {
-                    "command": {"type": "STRING", "description": "Command terminal yang akan dijalankan (misal: 'pip install requests', 'git status')"}
-                },
-                "required": ["command"]
-            }
-        elif func_name == "search_files":
-            return {
-                "type": "OBJECT",
-                "properties": {
-                    "pattern": {"type": "STRING", "description": "Glob pattern untuk file (misal: '**/*.py')"},
-                    "query": {"type": "STRING", "description": "Text yang dicari di dalam file"}
-                },
-                "required": ["pattern", "query"]
-            }
-        elif func_name == "web_search":
-            return {
-                "type": "OBJECT",
-                "properties": {
-                    "query": {"type": "STRING", "description": "Kata kunci pencarian"}
-                },
-                "required": ["query"]
-            }
-        return {"type": "OBJECT", "properties": {}}
+        return _PARAM_SCHEMAS.get(func_name, _EMPTY_SCHEMA)
+
+    def _confirm(self, tool_name, args, kind=""):
+        """Prompt konfirmasi Safe Mode. Return True jika user mengizinkan"""
+        import json
+        print(f"\n⚠️  [SAFE MODE] Gemini wants to execute{kind}: {tool_name}")
+        print(f"   Args: {json.dumps(args, ensure_ascii=False)}") # Satu baris: indent=2 memaksa encoder Python murni (lambat)
+        user_confirm = input("   Allow this action? (y/n): ").strip().lower()
+        return user_confirm == 'y'
+
+    def _find_mcp_client(self, tool_name):
+        """Cari MCP client (yang connected) pemilik tool ini"""
+        sig = tuple((c.is_connected, c.tools_version) for c in self.mcp_clients)
+        if sig != self._mcp_index_sig:
+            index = {}
+            for client in self.mcp_clients:
+                if client.is_connected:
+                    for tool in client.tools:
+                        index.setdefault(tool["name"], client) # Client pertama yang menang, seperti sebelumnya
+            self._mcp_index = index
+            self._mcp_index_sig = sig
+        
+        client = self._mcp_index.get(tool_name)
+        return client if client and client.is_connected else None
+
+    def is_mcp_tool(self, tool_name):
+        return tool_name not in self.tools and self._find_mcp_client(tool_name) is not None
+
+    @staticmethod
+    def _format_mcp_result(result):
+        # MCP return dict {content: [...], isError: bool}
+        if result and "content" in result:
+            # Ambil text content pertama
+            for item in result["content"]:
+                if item["type"] == "text":
+                    return item["text"]
+        return str(result)
 
     def execute(self, tool_name, args):
         """Eksekusi tool (Local atau MCP) dengan Safe Mode Check"""
-        import gemini_core.config as config
-        
-        # Daftar tool sensitif yang butuh konfirmasi
-        SENSITIVE_TOOLS = ['run_terminal', 'write_file']
-        
         # Cek Safe Mode
         if config.SAFE_MODE and tool_name in SENSITIVE_TOOLS:
-            print(f"\n⚠️  [SAFE MODE] Gemini wants to execute: {tool_name}")
-            print(f"   Args: {json.dumps(args, indent=2)}")
-            user_confirm = input("   Allow this action? (y/n): ").strip().lower()
-            if user_confirm != 'y':
+            if not self._confirm(tool_name, args):
                 return "Error: User denied execution."
 
         # 1. Cek Local Tools
@@ -119,45 +186,347 @@ class ToolRegistry:
                 return f"Error executing {tool_name}: {str(e)}"
         
         # 2. Cek MCP Tools
-        for client in self.mcp_clients:
-            if client.is_connected:
-                # Cek apakah tool ini milik client ini
-                for tool in client.tools:
-                    if tool["name"] == tool_name:
-                        # MCP Tools dianggap sensitif secara default di Safe Mode?
-                        # Untuk sekarang kita anggap aman kecuali kita punya list spesifik
-                        # Atau kita bisa tanya user untuk SEMUA MCP tool jika paranoid
-                        if config.SAFE_MODE:
-                             print(f"\n⚠️  [SAFE MODE] Gemini wants to execute MCP Tool: {tool_name}")
-                             print(f"   Args: {json.dumps(args, indent=2)}")
-                             user_confirm = input("   Allow this action? (y/n): ").strip().lower()
-                             if user_confirm != 'y':
-                                 return "Error: User denied execution."
-
-                        logger.info(f"Executing MCP Tool: {tool_name}")
-                        result = client.call_tool(tool_name, args)
-                        # MCP return dict {content: [...], isError: bool}
-                        if result and "content" in result:
-                            # Ambil text content pertama
-                            for item in result["content"]:
-                                if item["type"] == "text":
-                                    return item["text"]
-                        return str(result)
+        client = self._find_mcp_client(tool_name)
+        if client:
+            # MCP Tools dianggap sensitif secara default di Safe Mode
+            if config.SAFE_MODE and not self._confirm(tool_name, args, " MCP Tool"):
+                return "Error: User denied execution."
+
+            logger.info(f"Executing MCP Tool: {tool_name}")
+            return self._format_mcp_result(client.call_tool(tool_name, args))
                         
         return f"Error: Tool '{tool_name}' not found."
 
+    def execute_mcp_batch(self, function_calls):
+        """
+        Eksekusi beberapa MCP tool call sekaligus. Call ke server yang sama dikirim dalam
+        satu write (batch) lalu ditunggu bersama. Hasil dikembalikan sesuai urutan function_calls.
+        """
+        results = [None] * len(function_calls)
+        by_client = {} # client -> [(index, fc)]
+        
+        # Konfirmasi Safe Mode dulu (berurutan), sebelum ada request yang dikirim
+        for i, fc in enumerate(function_calls):
+            client = self._find_mcp_client(fc['name'])
+            if not client:
+                results[i] = f"Error: Tool '{fc['name']}' not found."
+            elif config.SAFE_MODE and not self._confirm(fc['name'], fc['args'], " MCP Tool"):
+                results[i] = "Error: User denied execution."
+            else:
+                by_client.setdefault(client, []).append((i, fc))
+        
+        for client, items in by_client.items():
+            logger.info(f"Executing {len(items)} MCP Tools in one batch")
+            batch_results = client.call_tools_batch([(fc['name'], fc['args']) for _, fc in items])
+            for (i, _), result in zip(items, batch_results):
+                results[i] = self._format_mcp_result(result)
+        return results
+
+# --- Helper search_files ---
+
+_MAGIC_CHARS = re.compile(r'[*?[]')
+
+# Directory & ekstensi yang tidak pernah berisi text yang dicari (dilewati saat walk, sebelum file dibuka)
+_SKIP_DIRS = frozenset({'.git', 'node_modules', '__pycache__', '.venv', 'venv', 'dist', 'build', '.mypy_cache'})
+_BINARY_EXTS = frozenset({
+    '.png', '.jpg', '.jpeg', '.gif', '.pdf', '.zip', '.gz', '.tar', '.whl', '.pyc', '.so', '.dll', '.exe',
+    '.class', '.o', '.a', '.mp4', '.mp3', '.wav', '.ico', '.woff', '.woff2', '.ttf',
+})
+
+def _scandir_recursive(root, max_depth=None, accept=None, skip_hidden=False, skip_dirs=frozenset(), skip_exts=frozenset()):
+    """
+    Walk directory pakai os.scandir dan yield DirEntry untuk setiap file yang lolos accept(entry).
+    Tipe entry diambil dari cache DirEntry (stat hanya untuk symlink). Symlink directory diikuti seperti glob,
+    tapi target yang sudah pernah dikunjungi lewat symlink dilewati supaya symlink loop tidak walk tanpa akhir.
+    max_depth=1 berarti hanya isi root (untuk pattern tanpa '**'); skip_hidden tidak masuk ke directory '.xxx'.
+    Directory di skip_dirs dan file dengan ekstensi (lowercase) di skip_exts dilewati.
+    """
+    stack = [(root, 1)]
+    seen_links = set()
+    while stack:
+        path, depth = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    name = entry.name
+                    if entry.is_dir():
+                        if ((max_depth is None or depth < max_depth)
+                                and not (skip_hidden and name[0] == '.') and name not in skip_dirs):
+                            if entry.is_symlink():
+                                st = entry.stat()
+                                if (st.st_dev, st.st_ino) in seen_links:
+                                    continue
+                                seen_links.add((st.st_dev, st.st_ino))
+                            stack.append((entry.path, depth + 1))
+                    elif entry.is_file():
+                        dot = name.rfind('.')
+                        if dot > 0 and name[dot:].lower() in skip_exts:
+                            continue
+                        if accept is None or accept(entry):
+                            yield entry
+        except OSError:
+            continue
+
+def _glob_component_regex(part):
+    """Translate satu komponen glob ('*', '?', '[...]') ke regex; tidak match '/' dan nama hidden"""
+    out = [r'(?!\.)'] if part[:1] in '*?[' else []
+    i, n = 0, len(part)
+    while i < n:
+        c = part[i]
+        i += 1
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and part[j] in '!^':
+                j += 1
+            if j < n and part[j] == ']':
+                j += 1
+            j = part.find(']', j)
+            if j == -1:
+                out.append(r'\[')
+            else:
+                # Escape seperti fnmatch: '\\', '[' dan operator set ('&&', '~~', '||') diperlakukan literal
+                body = re.sub(r'([&~|\[])', r'\\\1', part[i:j].replace('\\', '\\\\'))
+                if body[:1] == '!':
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = j + 1
+        else:
+            out.append(re.escape(c))
+    return ''.join(out)
+
+def _compile_glob(pattern):
+    """
+    Pecah pattern glob (semantik glob.glob recursive=True) jadi:
+    (root non-magic untuk mulai walk, kwargs untuk _scandir_recursive).
+    Di Windows matching case-insensitive, sama seperti glob (os.path.normcase).
+    """
+    drive, rest = os.path.splitdrive(pattern)
+    parts = rest.replace(os.sep, '/').split('/')
+    split = next(i for i, part in enumerate(parts) if _MAGIC_CHARS.search(part))
+    # Root diambil apa adanya dari pattern (separator asli, sama dengan output glob).
+    # Separator setelah drive ikut root: os.scandir('C:') = cwd drive C, bukan root drive C
+    root_len = len('/'.join(parts[:split])) or (1 if rest.startswith(('/', os.sep)) else 0)
+    root = drive + rest[:root_len]
+    magic = parts[split:]
+    max_depth = None if '**' in magic else len(magic)
+    # Seperti glob: '*'/'**' tidak pernah match nama hidden, kecuali pattern menulis '.' secara eksplisit
+    skip_hidden = not any(part.startswith('.') for part in magic)
+    # Directory/ekstensi yang disebut eksplisit di pattern (misal 'dist/**/*.js', '**/*.pyc') tetap di-walk
+    last_dot = parts[-1].rfind('.')
+    ext = parts[-1][last_dot:].lower() if last_dot != -1 else None
+    if ext in _BINARY_EXTS:
+        # Pattern memang mencari artefak build/binary (misal '**/*.pyc'): jangan skip apa pun
+        skip_dirs, skip_exts = frozenset(), frozenset()
+    else:
+        skip_dirs, skip_exts = _SKIP_DIRS.difference(parts), _BINARY_EXTS
+    walk = {
+        'max_depth': max_depth,
+        'skip_hidden': skip_hidden,
+        'skip_dirs': skip_dirs,
+        'skip_exts': skip_exts,
+    }
+    ignore_case = os.name == 'nt'
+    
+    # Fast path '**/*.ext': cukup cek akhiran nama file, tanpa regex
+    if len(magic) == 2 and magic[0] == '**' and magic[1].startswith('*.') and not _MAGIC_CHARS.search(magic[1][1:]):
+        ext = magic[1][1:]
+        if ignore_case:
+            ext = ext.lower()
+            walk['accept'] = lambda entry: entry.name.lower().endswith(ext) and entry.name[0] != '.'
+        else:
+            walk['accept'] = lambda entry: entry.name.endswith(ext) and entry.name[0] != '.'
+        return root, walk
+    
+    regex = []
+    for i, part in enumerate(magic):
+        last = i == len(magic) - 1
+        if part == '**':
+            regex.append(r'(?:(?!\.)[^/]+/)*(?!\.)[^/]+' if last else r'(?:(?!\.)[^/]+/)*')
+        else:
+            regex.append(_glob_component_regex(part) + ('' if last else '/'))
+    match = re.compile(''.join(regex) + r'\Z', re.IGNORECASE if ignore_case else 0).match
+    
+    # Regex dicocokkan ke path relatif terhadap root (root '' di-walk sebagai '.', jadi './' dilewati)
+    # Path entry = root + sep + nama, kecuali root sudah diakhiri separator atau cuma drive ('C:foo.py')
+    offset = len(root) + (0 if root.endswith(('/', os.sep)) or root == drive else 1) if root else 2
+    if os.sep == '/':
+        walk['accept'] = lambda entry: match(entry.path, offset) is not None
+    else:
+        walk['accept'] = lambda entry: match(entry.path[offset:].replace(os.sep, '/')) is not None
+    return root, walk
+
+def _iter_glob_files(pattern):
+    """Yield path file yang cocok dengan pattern (format path sama dengan glob.glob)"""
+    if not _MAGIC_CHARS.search(pattern):
+        if os.path.isfile(pattern):
+            yield pattern
+        return
+    
+    root, walk = _compile_glob(pattern)
+    strip = 0 if root else 2 # Buang prefix './' supaya path sama dengan output glob
+    for entry in _scandir_recursive(root or '.', **walk):
+        yield entry.path[strip:]
+
+# Pool untuk scan isi file search_files (I/O-bound, read/mmap.find melepas GIL)
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 4) * 4), thread_name_prefix="search")
+SEARCH_MAX_IN_FLIGHT = 256 # Batas scan yang menunggu (memory tetap kecil di tree besar)
+
+MMAP_MIN_SIZE = 64 * 1024 # File lebih kecil dari ini cukup dibaca biasa (setup mmap lebih mahal)
+BINARY_SNIFF_SIZE = 4096 # NUL di awal file = binary, tidak di-scan
+_HAS_FADVISE = hasattr(os, 'posix_fadvise')
+
+def _scan_file(filepath, query_b):
+    """Versi _file_contains untuk worker pool: error baca file dianggap tidak match"""
+    try:
+        return _file_contains(filepath, query_b)
+    except (OSError, ValueError):
+        return False
+
+def _file_contains(filepath, query_b):
+    """
+    Cek apakah file berisi query (bytes, tanpa decode: UTF-8 self-synchronizing jadi match bytes = match text).
+    File besar di-scan lewat mmap, berhenti di hit pertama. File binary (ada NUL di 4 KiB pertama) dilewati.
+    """
+    fd = os.open(filepath, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        size = os.fstat(fd).st_size
+        if size < MMAP_MIN_SIZE:
+            if not size:
+                return not query_b
+            data = os.read(fd, size + 1)
+            return b'\x00' not in data[:BINARY_SNIFF_SIZE] and data.find(query_b) != -1
+        # File besar dibaca sekali dari depan ke belakang: minta read-ahead agresif, lalu buang page-nya
+        # supaya page cache tool lain (misal read_file berikutnya) tidak terusir. File kecil tidak perlu
+        # (dua syscall tambahan per file lebih mahal dari manfaatnya)
+        if _HAS_FADVISE:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        try:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                return mm.find(b'\x00', 0, BINARY_SNIFF_SIZE) == -1 and mm.find(query_b) != -1
+        finally:
+            if _HAS_FADVISE:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+MAX_LIST_ENTRIES = 1000 # Batas entry yang ditampilkan list_directory
+
+# --- Helper read_file / write_file ---
+
+READ_MMAP_MIN_SIZE = 16 * 1024 * 1024 # File sebesar ini di-decode langsung dari mmap (tanpa bytes perantara)
+
+def _read_text(filepath):
+    """Baca file sebagai UTF-8: satu os.read seukuran file lalu decode sekali (newline dinormalisasi ke '\\n')"""
+    fd = os.open(filepath, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        size = os.fstat(fd).st_size
+        if size >= READ_MMAP_MIN_SIZE:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                text = str(mm, 'utf-8', 'replace')
+        else:
+            data = os.read(fd, size) if size else b''
+            if len(data) < size or not size:
+                # Read pendek atau file virtual (/proc, size 0): baca sampai EOF
+                chunks = [data]
+                while True:
+                    chunk = os.read(fd, 1024 * 1024)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                data = b''.join(chunks)
+            text = data.decode('utf-8', 'replace')
+    finally:
+        os.close(fd)
+    # Samakan dengan open() mode text (universal newlines)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+WRITE_CHUNK_SIZE = 1024 * 1024
+
+def _write_bytes(filepath, data):
+    """Tulis bytes langsung via os.write (per 1 MiB); makedirs hanya kalau directory belum ada"""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+    try:
+        fd = os.open(filepath, flags, 0o644)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        fd = os.open(filepath, flags, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view[:WRITE_CHUNK_SIZE])
+            view = view[written:]
+    finally:
+        os.close(fd)
+
+# --- Helper web_search ---
+
+WEB_SEARCH_CACHE_SIZE = 64
+WEB_SEARCH_CACHE_TTL = 300 # detik
+
+_DDGS_CLASS = None
+_DDGS_LOCAL = threading.local() # Satu instance DDGS per thread: instance-nya tidak aman dipakai bersamaan
+_DDGS_LOCK = threading.Lock()
+_WEB_SEARCH_CACHE = OrderedDict() # (query, region, safesearch, max_results) -> (timestamp, results)
+
+def _get_ddgs():
+    """
+    Instance DDGS milik thread ini, dibuat sekali per thread (session HTTP & cookie dipakai ulang).
+    web_search parallel-safe, jadi thread pool tool tidak boleh berbagi satu instance. Raise ImportError kalau library belum ada
+    """
+    global _DDGS_CLASS
+    ddgs = getattr(_DDGS_LOCAL, 'ddgs', None)
+    if ddgs is None:
+        if _DDGS_CLASS is None:
+            with _DDGS_LOCK:
+                if _DDGS_CLASS is None:
+                    try:
+                        from duckduckgo_search import DDGS
+                    except ImportError:
+                        from ddgs import DDGS
+                    
+                    import warnings
+                    # Suppress specific RuntimeWarning from duckduckgo_search by message
+                    warnings.filterwarnings("ignore", message=".*renamed to.*ddgs.*", category=RuntimeWarning)
+                    _DDGS_CLASS = DDGS
+        ddgs = _DDGS_LOCAL.ddgs = _DDGS_CLASS()
+    return ddgs
+
+def _cached_web_search(query, region, safesearch, max_results):
+    """DDGS.text dengan cache LRU + TTL (agent sering mengulang query yang sama)"""
+    key = (query, region, safesearch, max_results)
+    now = time.monotonic()
+    with _DDGS_LOCK:
+        hit = _WEB_SEARCH_CACHE.get(key)
+        if hit and now - hit[0] < WEB_SEARCH_CACHE_TTL:
+            _WEB_SEARCH_CACHE.move_to_end(key)
+            return hit[1]
+    
+    results = _get_ddgs().text(query, region=region, safesearch=safesearch, max_results=max_results)
+    with _DDGS_LOCK:
+        _WEB_SEARCH_CACHE[key] = (now, results)
+        _WEB_SEARCH_CACHE.move_to_end(key)
+        if len(_WEB_SEARCH_CACHE) > WEB_SEARCH_CACHE_SIZE:
+            _WEB_SEARCH_CACHE.popitem(last=False)
+    return results
+
 # --- Implementasi Tools ---
 
 registry = ToolRegistry()
 
-@registry.register
+@registry.register(parallel_safe=True)
 def read_file(filepath):
     """Membaca isi file text."""
     try:
-        if not os.path.exists(filepath):
-            return f"Error: File '{filepath}' not found."
-        with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-            return f.read()
+        return _read_text(filepath)
+    except FileNotFoundError:
+        return f"Error: File '{filepath}' not found."
     except Exception as e:
         return f"Error reading file: {e}"
 
@@ -165,103 +534,103 @@ def read_file(filepath):
 def write_file(filepath, content):
     """Menulis content ke file (overwrite)."""
     try:
-        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
+        # Sama dengan open(..., 'w') sebelumnya: '\n' jadi os.linesep (CRLF di Windows)
+        if os.linesep != '\n':
+            content = content.replace('\n', os.linesep)
+        _write_bytes(filepath, content.encode('utf-8'))
         return f"Successfully wrote to '{filepath}'"
     except Exception as e:
         return f"Error writing file: {e}"
 
-@registry.register
+@registry.register(parallel_safe=True)
 def list_directory(path="."):
     """List isi directory."""
     try:
-        if not os.path.exists(path):
-            return f"Error: Path '{path}' not found."
-        items = os.listdir(path)
-        result = []
-        for item in items:
-            full_path = os.path.join(path, item)
-            type_str = "DIR" if os.path.isdir(full_path) else "FILE"
-            result.append(f"[{type_str}] {item}")
-        return "\n".join(result)
+        # Tipe entry dari cache DirEntry (tanpa stat per item)
+        with os.scandir(os.fspath(path)) as it:
+            listing = "\n".join(
+                f"[{'DIR' if entry.is_dir() else 'FILE'}] {entry.name}"
+                for entry in itertools.islice(it, MAX_LIST_ENTRIES)
+            )
+            # Sisa entry hanya dihitung (directory besar seperti node_modules)
+            remaining = sum(1 for _ in it)
+        if remaining:
+            listing += f"\n... ({remaining} more entries)"
+        return listing
+    except FileNotFoundError:
+        return f"Error: Path '{path}' not found."
     except Exception as e:
         return f"Error listing directory: {e}"
 
 @registry.register
 def run_terminal(command):
     """Menjalankan command terminal/shell dan mengembalikan outputnya."""
+    import subprocess # Lazy: hanya dibutuhkan tool ini
     try:
-        # PENTING: Shell=True berbahaya jika input tidak divalidasi.
+        # PENTING: Command dijalankan lewat shell, berbahaya jika input tidak divalidasi.
         # Untuk tool pribadi ini oke, tapi hati-hati.
+        # stderr digabung ke stdout di level OS (satu pipe, satu decode)
+        import locale
         result = subprocess.run(
             command, 
             shell=True, 
-            capture_output=True, 
-            text=True, 
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             timeout=60
         )
-        output = result.stdout
-        if result.stderr:
-            output += f"\nSTDERR:\n{result.stderr}"
+        output = result.stdout.decode(locale.getpreferredencoding(False), errors='replace')
+        if result.returncode:
+            if output and not output.endswith('\n'):
+                output += '\n'
+            output += f"(Exit code: {result.returncode})"
         return output if output.strip() else "(No output)"
     except subprocess.TimeoutExpired:
         return "Error: Command timed out (60s limit)"
     except Exception as e:
         return f"Error running command: {e}"
 
-@registry.register
+@registry.register(parallel_safe=True)
 def search_files(pattern, query):
     """Mencari text di dalam file-file yang cocok dengan pattern."""
     try:
+        query_b = query.encode('utf-8', 'ignore')
         matches = []
-        files = glob.glob(pattern, recursive=True)
-        for filepath in files:
-            if os.path.isfile(filepath):
-                try:
-                    with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                        if query in content:
-                            matches.append(filepath)
-                except:
-                    pass
+        # Pipeline: thread ini walk directory (producer), pool scan isi file (consumer).
+        # Maksimal SEARCH_MAX_IN_FLIGHT scan tertunda; hasil dikumpulkan sesuai urutan walk supaya output stabil
+        in_flight = deque()
+        for filepath in _iter_glob_files(pattern):
+            if len(in_flight) >= SEARCH_MAX_IN_FLIGHT:
+                done_path, scan = in_flight.popleft()
+                if scan.result():
+                    matches.append(done_path)
+            in_flight.append((filepath, _SEARCH_POOL.submit(_scan_file, filepath, query_b)))
+        for done_path, scan in in_flight:
+            if scan.result():
+                matches.append(done_path)
         if not matches:
             return "No matches found."
         return "Found in files:\n" + "\n".join(matches)
     except Exception as e:
         return f"Error searching files: {e}"
 
-@registry.register
+@registry.register(parallel_safe=True)
 def web_search(query):
     """
     Melakukan pencarian di internet (Web Search) untuk mendapatkan informasi terkini.
     Gunakan ini jika user bertanya tentang berita terbaru, dokumentasi library, atau hal yang tidak ada di knowledge base.
     """
     try:
-        try:
-            from duckduckgo_search import DDGS
-        except ImportError:
-            from ddgs import DDGS
-        
-        import warnings
-        # Suppress specific RuntimeWarning from duckduckgo_search by message
-        warnings.filterwarnings("ignore", message=".*renamed to.*ddgs.*", category=RuntimeWarning)
-        
         logger.info(f"Searching web for: {query}")
         # Use region='id-id' for better local results, safesearch='moderate'
-        results = DDGS().text(query, region='id-id', safesearch='moderate', max_results=5)
+        results = _cached_web_search(query, region='id-id', safesearch='moderate', max_results=5)
         
         if not results:
             return "No results found."
             
-        formatted_results = []
-        for r in results:
-            title = r.get('title', 'No Title')
-            link = r.get('href', '#')
-            body = r.get('body', '')
-            formatted_results.append(f"Title: {title}\nLink: {link}\nSnippet: {body}\n")
-            
-        return "\n---\n".join(formatted_results)
+        return "\n---\n".join(
+            f"Title: {r.get('title', 'No Title')}\nLink: {r.get('href', '#')}\nSnippet: {r.get('body', '')}\n"
+            for r in results
+        )
     except ImportError:
         return "Error: Library 'ddgs' (or 'duckduckgo-search') not installed. Please install it to use this tool."
     except Exception as e: